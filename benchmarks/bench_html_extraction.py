@@ -0,0 +1,75 @@
+# Compare the parse time and peak memory of the lightweight HTML extraction against the original BeautifulSoup parses.
+# Usage: python benchmarks/bench_html_extraction.py [directory of saved pages]
+#
+# The directory should hold saved copies of EliteProspects pages named player_*.html (full player pages) and iframe_*.html
+# (iframe_player_stats.php pages). Without a directory, synthetic pages of a similar size are used instead.
+import glob
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ep_parsing import extract_last_table_row, extract_last_table_row_with_soup, extract_profile_image_src, extract_profile_image_src_with_soup, \
+                       profile_image_class
+
+# The original way classify_player() found the last stats row, parsing the whole page.
+def extract_last_table_row_with_full_soup(page_text):
+    from bs4 import BeautifulSoup
+    return str(BeautifulSoup(page_text, 'html.parser').find('body').find_all('tr')[-1])
+
+# Build a player page with the profile photo near the top followed by a lot of unrelated markup, like the real pages.
+def make_player_page():
+    filler = ''.join('<div class="section"><span>Stat %d</span><a href="/link/%d">Link</a></div>\n' % (i, i) for i in range(8000))
+    return '<html><head><title>Player</title></head><body><header>%s</header><img class="%s" src="//files.eliteprospects.com/player.jpg">%s</body></html>' \
+           % (filler[:20000], profile_image_class, filler)
+
+# Build a stats iframe page with a long table of seasons.
+def make_iframe_page():
+    rows = ''.join('<tr><td>%d-%d</td><td>Some Team</td><td>%d</td><td>%d</td><td>%d</td><td>%d</td><td>%d</td></tr>\n' % (2000 + i, 2001 + i, i, i, i, i, i)
+                   for i in range(400))
+    return '<html><body><table>%s<tr><td>2025-26</td><td>Michigan Tech</td><td>-</td><td>-</td><td>-</td><td>-</td><td>-</td></tr></table></body></html>' % rows
+
+# Time a function on a page and measure the peak memory it allocates.
+def measure(function, page_text):
+    seconds = min(timeit.repeat(lambda: function(page_text), number=1, repeat=5))
+
+    tracemalloc.start()
+    function(page_text)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds, peak_bytes
+
+# Print the measurements of each approach for one page.
+def report(name, page_text, approaches):
+    print('%s (%d KB)' % (name, len(page_text) // 1024))
+    results = [function(page_text) for _, function in approaches]
+
+    if len(set(results)) != 1:
+        print('  WARNING: the approaches disagree: %s' % results)
+
+    for label, function in approaches:
+        seconds, peak_bytes = measure(function, page_text)
+        print('  %-24s %9.2f ms %10.1f KB peak' % (label, seconds * 1000, peak_bytes / 1024))
+
+def main():
+    if len(sys.argv) > 1:
+        player_pages = sorted(glob.glob(os.path.join(sys.argv[1], 'player_*.html')))
+        iframe_pages = sorted(glob.glob(os.path.join(sys.argv[1], 'iframe_*.html')))
+        pages = [(path, open(path, encoding='utf-8').read()) for path in player_pages + iframe_pages]
+    else:
+        pages = [('synthetic player_page.html', make_player_page()), ('synthetic iframe_page.html', make_iframe_page())]
+
+    for name, page_text in pages:
+        if 'iframe' in os.path.basename(name):
+            report(name, page_text, [('BeautifulSoup (full)', extract_last_table_row_with_full_soup),
+                                     ('BeautifulSoup (strainer)', extract_last_table_row_with_soup),
+                                     ('Lightweight', extract_last_table_row)])
+        else:
+            report(name, page_text, [('BeautifulSoup (full)', extract_profile_image_src_with_soup),
+                                     ('Lightweight', extract_profile_image_src)])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Compare the original per-URL regex scan against the player ID index when matching feed entries to a roster.
+# Usage: python benchmarks/bench_player_matching.py [roster size] [feed size]
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ep_parsing import build_player_id_index, parse_transaction
+
+# Build a roster of player page URLs like the ones found on the 'Where are they now' page.
+def make_roster(roster_size):
+    return ['https://www.eliteprospects.com/player/%d/player-%d' % (100000 + i, i) for i in range(roster_size)]
+
+# Build feed descriptions where roughly one in ten mentions a rostered player.
+def make_descriptions(roster_size, feed_size):
+    descriptions = []
+
+    for i in range(feed_size):
+        if i % 10 == 0:
+            player_id = 100000 + random.randrange(roster_size)
+        else:
+            player_id = 900000 + i
+
+        descriptions.append(
+            'Status: Confirmed<br/>\nDate: 2024-05-01<br/>\n'
+            'Player: <a href="https://www.eliteprospects.com/player/%d/player-%d">Player %d</a><br/>\n'
+            'From: <a href="https://www.eliteprospects.com/team/1/from-team">From Team</a><br/>\n'
+            'To: <a href="https://www.eliteprospects.com/team/2/to-team">To Team</a><br/>' % (player_id, player_id - 100000, i)
+        )
+
+    return descriptions
+
+# The original approach: search the description for every roster URL in turn.
+def match_with_regex_scan(player_page_urls, descriptions):
+    matched = 0
+
+    for decoded_description in descriptions:
+        for url in player_page_urls:
+            if re.search(url, decoded_description):
+                matched += 1
+                break
+
+    return matched
+
+# The indexed approach: parse the transaction like the watcher does and look its player's ID up.
+def match_with_index(player_id_index, descriptions):
+    matched = 0
+
+    for decoded_description in descriptions:
+        if parse_transaction('', '', decoded_description).player_id in player_id_index:
+            matched += 1
+
+    return matched
+
+def main():
+    roster_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    feed_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    random.seed(548)
+
+    player_page_urls = make_roster(roster_size)
+    descriptions = make_descriptions(roster_size, feed_size)
+    player_id_index = build_player_id_index(player_page_urls)
+
+    if match_with_regex_scan(player_page_urls, descriptions) != match_with_index(player_id_index, descriptions):
+        raise Exception('The two matching approaches disagree')
+
+    runs = 5
+    scan_time = min(timeit.repeat(lambda: match_with_regex_scan(player_page_urls, descriptions), number=1, repeat=runs))
+    index_build_time = min(timeit.repeat(lambda: build_player_id_index(player_page_urls), number=1, repeat=runs))
+    index_time = min(timeit.repeat(lambda: match_with_index(player_id_index, descriptions), number=1, repeat=runs))
+
+    print('Roster size: %d players, feed size: %d entries' % (roster_size, feed_size))
+    print('Regex scan:   %10.3f ms' % (scan_time * 1000))
+    print('Index build:  %10.3f ms' % (index_build_time * 1000))
+    print('Index lookup: %10.3f ms' % (index_time * 1000))
+    print('Speedup (including index build): %.1fx' % (scan_time / (index_build_time + index_time)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Compare the original separate regex searches over each feed entry against parsing it once into a TransactionRecord.
+# Usage: python benchmarks/bench_transaction_parsing.py [recorded feed file] [entry count]
+#
+# The feed file should be a saved copy of the EliteProspects transfers RSS feed (the replay harness's fixtures/transfers.xml works too).
+# Its entries are repeated until there are at least entry count of them. Without a file, synthetic entries are used instead.
+import os
+import random
+import re
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ep_parsing import decode_description, parse_transaction
+
+# The team the original code looked for, and the NCAA D1 team IDs it kept as a list.
+team_id = '548'
+ncaa_d1_team_id_list = ['2453', '1252', '18066', '1273', '35387', '790', '2319', '911', '633', '1214', '1320', '1583', '685', '913', '1859', '706',
+                        '840', '1917', '728', '1339', '1792', '35273', '30556', '1866', '1871', '1248', '1157', '548', '1520', '2110', '1465', '925',
+                        '1549', '2118', '1551', '713', '2078', '2039', '1543', '1758', '2299', '773', '1772', '4991', '1038', '1366', '1915', '2071',
+                        '1362', '2034', '606', '1074', '803', '776', '1794', '708', '1136', '1137', '1554', '2745', '710', '452', '1250', '786']
+ncaa_d1_team_ids = frozenset(ncaa_d1_team_id_list)
+
+# Build feed entries (guid, title, description) where roughly one in ten involves the team, some of them from or to another D1 team.
+def make_entries(entry_count):
+    entries = []
+
+    for i in range(entry_count):
+        from_team_id, to_team_id = random.randrange(10000, 20000), random.randrange(10000, 20000)
+        if i % 10 == 0:
+            from_team_id = team_id
+        elif i % 10 == 5:
+            to_team_id = team_id
+        if i % 30 == 0:
+            to_team_id = random.choice(ncaa_d1_team_id_list)
+
+        description = ('Status: Confirmed<br />\nDate: 2025-04-01<br />\n'
+                       'Player: <a href="https://www.eliteprospects.com/player/%d/player-%d">Player %d</a><br />\n'
+                       'From: <a href="https://www.eliteprospects.com/team/%s/from-team">From Team</a><br />\n'
+                       'To: <a href="https://www.eliteprospects.com/team/%s/to-team">To Team</a><br />'
+                       % (100000 + i, i, i, from_team_id, to_team_id))
+        if i % 4 == 0:
+            description += '\nInformation: Signed a two-year contract<br />'
+
+        entries.append(('https://www.eliteprospects.com/t/%d' % (500000 + i), 'Player %d to To Team' % i, description))
+
+    return entries
+
+# Read the entries of a recorded feed, repeating them until there are at least entry_count.
+def load_entries(path, entry_count):
+    import feedparser
+
+    items = feedparser.parse(path).entries
+    entries = [(item.guid, item.title, item.description) for item in items]
+    return (entries * (entry_count // max(len(entries), 1) + 1))[:max(entry_count, len(entries))]
+
+# The original approach: search the description for each piece it needs, with the patterns given as strings and list membership for the D1 teams.
+# Returns what was extracted, so it can be checked against the record.
+def parse_with_separate_searches(guid, title, description):
+    transaction_id = re.search(r'/t/(\d*)', guid).group(1)
+    decoded_description = decode_description(description)
+
+    inter_university = False
+    if re.search(r'From: <a href="https:\/\/www\.eliteprospects\.com\/team\/' + team_id + r'\/', decoded_description):
+        match = re.search(r'To: <a href="https:\/\/www\.eliteprospects\.com\/team\/(\d*)\/', decoded_description)
+        inter_university = match is not None and match.group(1) in ncaa_d1_team_id_list
+    elif re.search(r'To: <a href="https:\/\/www\.eliteprospects\.com\/team\/' + team_id + r'\/', decoded_description):
+        match = re.search(r'From: <a href="https:\/\/www\.eliteprospects\.com\/team\/(\d*)\/', decoded_description)
+        inter_university = match is not None and match.group(1) in ncaa_d1_team_id_list
+
+    details = re.search(r'(Status: .*)<br/>\nDate: .*<br/>\nPlayer: <a href=\"(.*)\">', decoded_description)
+    information = None
+    if re.search(r'Information:', decoded_description):
+        information = re.search(r'(Information: .*)<br/>', decoded_description).group(1)
+
+    return transaction_id, inter_university, details.group(1), details.group(2), information
+
+# The record approach: parse the entry once and read the fields.
+def parse_with_record(guid, title, description):
+    record = parse_transaction(guid, title, description)
+
+    inter_university = False
+    if record.origin_team_id == team_id:
+        inter_university = record.destination_team_id in ncaa_d1_team_ids
+    elif record.destination_team_id == team_id:
+        inter_university = record.origin_team_id in ncaa_d1_team_ids
+
+    information = 'Information: ' + record.information if record.information is not None else None
+    return record.transaction_id, inter_university, 'Status: ' + record.status, record.player_url, information
+
+# Time an approach over every entry and measure the peak memory it allocates.
+def measure(function, entries):
+    seconds = min(timeit.repeat(lambda: [function(*entry) for entry in entries], number=1, repeat=5))
+
+    tracemalloc.start()
+    results = [function(*entry) for entry in entries]
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds, peak_bytes, results
+
+def main():
+    entry_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    entries = load_entries(sys.argv[1], entry_count) if len(sys.argv) > 1 else make_entries(entry_count)
+    print('%d feed entries' % len(entries))
+
+    approaches = [('Separate searches', parse_with_separate_searches), ('TransactionRecord', parse_with_record)]
+    measurements = [measure(function, entries) for _, function in approaches]
+
+    if measurements[0][2] != measurements[1][2]:
+        print('  WARNING: the approaches disagree')
+
+    for (label, _), (seconds, peak_bytes, _) in zip(approaches, measurements):
+        print('  %-20s %9.2f ms %8.2f us/entry %10.1f KB peak' % (label, seconds * 1000, seconds * 1000000 / len(entries), peak_bytes / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import collections
+import sqlite3
+import threading
+import time
+import uuid
+import requests
+import run_metrics
+from http_fetch import session, request_timeout
+
+# Discord's limits on a single webhook message.
+max_message_length = 2000
+max_message_embeds = 10
+
+# How many times a rate limited message is retried before leaving it for the next delivery, and the longest Retry-After we're willing to wait out.
+max_rate_limit_retries = 5
+max_retry_after = 60
+
+# Statuses Discord answers with when it won't ever accept a message as it is (like one with a bad image URL, or one that's too large).
+# Other failures are retried on the next delivery.
+rejected_status_codes = (400, 413)
+
+# What post_alerts() can return.
+delivered = 'delivered'
+retry_later = 'retry later'
+rejected = 'rejected'
+
+# Set to stop delivering: pending alerts are left for the next delivery instead of waiting out rate limits. The daemon sets it on shutdown.
+stop_event = threading.Event()
+
+# How long delivered (and failed) alerts are kept around (in seconds) so the same alert isn't queued again.
+delivered_retention = 14 * 24 * 60 * 60
+
+# How long (in seconds) alerts claimed by a delivery stay claimed. A delivery that hasn't finished by then is assumed to have crashed,
+# and its alerts can be claimed by the next one.
+claim_timeout = 30 * 60
+
+# A queue of Discord alerts kept in an SQLite database, so alerts that can't be delivered right away (because of a rate limit or a network
+# error) are kept and retried later instead of being lost. Each alert has a key that stops the same alert from being queued twice, and an
+# optional record that's handed back to the caller once the alert has been delivered. An alert Discord rejects for good is marked as
+# failed instead, so it doesn't hold up the alerts behind it.
+# Several watchers can share a database: each one names its own queue, and only ever delivers (and gets back the records of) its own alerts.
+class DiscordOutbox:
+    def __init__(self, path, queue):
+        self.queue = queue
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, dedupe_key TEXT NOT NULL UNIQUE, '
+                                    'webhook_url TEXT NOT NULL, content TEXT NOT NULL, image_url TEXT, record TEXT, created_at REAL NOT NULL, delivered_at REAL, '
+                                    'queue TEXT, claimed_at REAL, claimed_by TEXT, failed_at REAL)')
+
+            # Databases created before alerts had queues, could be claimed or could fail are given the missing columns. Their alerts
+            # without a queue are handed out by adopt_alerts().
+            columns = [column[1] for column in self.connection.execute('PRAGMA table_info(alerts)')]
+            for column, column_type in [('queue', 'TEXT'), ('claimed_at', 'REAL'), ('claimed_by', 'TEXT'), ('failed_at', 'REAL')]:
+                if column not in columns:
+                    self.connection.execute('ALTER TABLE alerts ADD COLUMN %s %s' % (column, column_type))
+
+            self.connection.execute('DELETE FROM alerts WHERE delivered_at < ? OR failed_at < ?', (time.time() - delivered_retention, time.time() - delivered_retention))
+
+    def close(self):
+        self.connection.close()
+
+    # Add an alert to the queue. Returns False if an alert with the same key was already queued (whether or not it's been delivered yet).
+    def enqueue(self, dedupe_key, webhook_url, content, image_url=None, record=None):
+        with self.connection:
+            cursor = self.connection.execute('INSERT OR IGNORE INTO alerts (dedupe_key, webhook_url, content, image_url, record, created_at, queue) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                             (dedupe_key, webhook_url, content, image_url, record, time.time(), self.queue))
+            return cursor.rowcount == 1
+
+    # Check whether an alert with the given key has been queued.
+    def is_queued(self, dedupe_key):
+        return self.connection.execute('SELECT 1 FROM alerts WHERE dedupe_key = ?', (dedupe_key,)).fetchone() is not None
+
+    # Move this queue's alerts whose keys start with key_start to keys starting with the given prefix, for when the format of the keys changes.
+    def add_key_prefix(self, key_start, prefix):
+        with self.connection:
+            self.connection.execute('UPDATE OR IGNORE alerts SET dedupe_key = ? || dedupe_key WHERE substr(dedupe_key, 1, ?) = ? AND queue = ?',
+                                    (prefix, len(key_start), key_start, self.queue))
+
+    # Take the alerts queued before alerts had queues whose keys contain key_part into this queue.
+    def adopt_alerts(self, key_part):
+        with self.connection:
+            self.connection.execute('UPDATE alerts SET queue = ? WHERE queue IS NULL AND instr(dedupe_key, ?) > 0', (self.queue, key_part))
+
+    # Return this queue's alerts that haven't been delivered (or failed) yet, oldest first. Each alert is [ID, webhook URL, content, image URL, record].
+    def get_pending(self):
+        return [list(row) for row in self.connection.execute('SELECT id, webhook_url, content, image_url, record FROM alerts WHERE delivered_at IS NULL AND failed_at IS NULL AND queue = ? ORDER BY id',
+                                                             (self.queue,))]
+
+    # Claim this queue's pending alerts that no other delivery is working on, and return them like get_pending() does. The claim is made in
+    # a single write transaction, so two deliveries running at the same time (like cron and the daemon) never claim the same alert.
+    def claim_pending(self, claimed_by):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('UPDATE alerts SET claimed_at = ?, claimed_by = ? WHERE queue = ? AND delivered_at IS NULL AND failed_at IS NULL '
+                                    'AND (claimed_at IS NULL OR claimed_at < ?)',
+                                    (time.time(), claimed_by, self.queue, time.time() - claim_timeout))
+
+        return [list(row) for row in self.connection.execute('SELECT id, webhook_url, content, image_url, record FROM alerts '
+                                                             'WHERE delivered_at IS NULL AND failed_at IS NULL AND claimed_by = ? ORDER BY id', (claimed_by,))]
+
+    # Release the claims a delivery still holds on alerts it didn't deliver, so the next delivery can retry them straight away.
+    def release_claims(self, claimed_by):
+        with self.connection:
+            self.connection.execute('UPDATE alerts SET claimed_at = NULL, claimed_by = NULL WHERE claimed_by = ? AND delivered_at IS NULL', (claimed_by,))
+
+    # Deliver every pending alert in this queue, combining consecutive alerts for the same webhook into as few messages as Discord's limits allow.
+    # Only alerts this delivery managed to claim are sent, so alerts aren't duplicated when deliveries overlap.
+    # on_delivered is called with the records of each message's alerts once Discord has confirmed receiving it. Alerts for a webhook stop
+    # being delivered after one of its messages fails, so they're still sent in order when they're retried. A message Discord rejects for good
+    # is sent again one alert at a time, and the alerts that are still rejected on their own are marked as failed. Returns how many alerts were delivered.
+    def deliver(self, on_delivered=None):
+        claimed_by = uuid.uuid4().hex
+        try:
+            return self.deliver_claimed(claimed_by, on_delivered)
+        finally:
+            self.release_claims(claimed_by)
+
+    def deliver_claimed(self, claimed_by, on_delivered):
+        failed_webhook_urls = set()
+        delivered_count = 0
+
+        batches = collections.deque(coalesce_alerts(self.claim_pending(claimed_by)))
+        while batches:
+            batch = batches.popleft()
+            webhook_url = batch[0][1]
+            if webhook_url in failed_webhook_urls:
+                continue
+
+            if stop_event.is_set():
+                break
+
+            result = post_alerts(webhook_url, batch)
+            if result == rejected and len(batch) > 1:
+                # It's most likely just one of the alerts Discord won't accept, so find out which by sending them one at a time.
+                batches.extendleft(reversed([[alert] for alert in batch]))
+                continue
+
+            if result == rejected:
+                self.fail(batch[0])
+                continue
+
+            if result == retry_later:
+                failed_webhook_urls.add(webhook_url)
+                continue
+
+            # Mark the alerts as delivered before handing back their records, so a crash in between can't cause them to be sent twice.
+            with self.connection:
+                self.connection.executemany('UPDATE alerts SET delivered_at = ? WHERE id = ?', [(time.time(), alert[0]) for alert in batch])
+
+            delivered_count += len(batch)
+            if on_delivered is not None:
+                on_delivered([alert[4] for alert in batch])
+
+        return delivered_count
+
+    # Mark an alert Discord won't ever accept as failed, so it's no longer retried. It's kept like a delivered alert, so it isn't queued again.
+    def fail(self, alert):
+        print('Discord rejected alert %d for good, it will not be retried: %s' % (alert[0], alert[2]))
+        run_metrics.increment('discord_dead_letters')
+
+        with self.connection:
+            self.connection.execute('UPDATE alerts SET failed_at = ? WHERE id = ?', (time.time(), alert[0]))
+
+# Split alerts into batches that can each be sent as one webhook message: all for the same webhook, with at most max_message_embeds images
+# and combined content no longer than max_message_length characters.
+def coalesce_alerts(alerts):
+    batches = []
+    batch_length = 0
+
+    for alert in alerts:
+        alert_length = min(len(alert[2]), max_message_length)
+
+        if batches and batches[-1][0][1] == alert[1] and batch_length + 2 + alert_length <= max_message_length \
+                and len([batch_alert for batch_alert in batches[-1] if batch_alert[3] is not None]) + (alert[3] is not None) <= max_message_embeds:
+            batches[-1].append(alert)
+            batch_length += 2 + alert_length
+        else:
+            batches.append([alert])
+            batch_length = alert_length
+
+    return batches
+
+# Send a batch of alerts to Discord as a single message. Rate limits are waited out according to Discord's Retry-After.
+# Returns delivered if Discord confirmed receiving the message, rejected if Discord won't ever accept it, or retry_later otherwise.
+def post_alerts(webhook_url, alerts):
+    payload = {
+        'content': '\n\n'.join(alert[2][:max_message_length] for alert in alerts),
+        'embeds': [{ 'image': { 'url': alert[3] } } for alert in alerts if alert[3] is not None]
+    }
+
+    for _ in range(max_rate_limit_retries + 1):
+        try:
+            response = session.post(webhook_url, json=payload, timeout=request_timeout)
+        except requests.RequestException as err:
+            print('Could not reach Discord, %d alerts will be retried later: %s' % (len(alerts), err))
+            run_metrics.increment('discord_failures')
+            return retry_later
+
+        if 200 <= response.status_code < 300:
+            run_metrics.increment('discord_messages_sent')
+            run_metrics.increment('discord_alerts_sent', len(alerts))
+            return delivered
+
+        if response.status_code in rejected_status_codes:
+            print('Discord rejected a message with status %d: %s' % (response.status_code, response.text))
+            run_metrics.increment('discord_failures')
+            return rejected
+
+        if response.status_code != 429:
+            print('Discord rejected a message with status %d, %d alerts will be retried later: %s' % (response.status_code, len(alerts), response.text))
+            run_metrics.increment('discord_failures')
+            return retry_later
+
+        retry_after = get_retry_after(response)
+        if retry_after > max_retry_after:
+            print('Discord is rate limiting for %.1f seconds, %d alerts will be retried later' % (retry_after, len(alerts)))
+            run_metrics.increment('discord_failures')
+            return retry_later
+
+        run_metrics.increment('discord_retries')
+        if stop_event.wait(retry_after):
+            print('Stopping, %d alerts will be retried later' % len(alerts))
+            return retry_later
+
+    print('Discord kept rate limiting, %d alerts will be retried later' % len(alerts))
+    run_metrics.increment('discord_failures')
+    return retry_later
+
+# Work out how many seconds Discord wants us to wait from a rate limited response.
+def get_retry_after(response):
+    try:
+        return float(response.json()['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        return float(response.headers.get('Retry-After', 1))
+    except ValueError:
+        return 1.0
@@ -0,0 +1,169 @@
+import re
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Matches an EliteProspects player page URL and captures the player's ID.
+player_url_regex = re.compile(r'https://www\.eliteprospects\.com/player/(\d+)/')
+
+# Build an index from player ID to player page URL, so checking whether a player is on a roster is a single lookup.
+def build_player_id_index(player_page_urls):
+    player_id_index = {}
+
+    for url in player_page_urls:
+        player_id = get_player_id(url)
+        if player_id is not None:
+            player_id_index[player_id] = url
+
+    return player_id_index
+
+# Return the player ID from an EliteProspects player page URL, or None if the URL isn't a player page.
+def get_player_id(player_page_url):
+    match = player_url_regex.match(player_page_url)
+    return match.group(1) if match else None
+
+# Class of the profile photo on an EliteProspects player page.
+profile_image_class = 'ProfileImage_profileImage__JLd31 ProfileImage_playerImage__1fLtE'
+
+# Size of the pieces a page is fed to ProfileImageParser in, so parsing can stop soon after the photo is found.
+parser_chunk_size = 16384
+
+# An HTML parser that only looks for the profile photo and ignores everything else on the page.
+class ProfileImageParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.src = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'img' or self.src is not None:
+            return
+
+        attributes = dict(attrs)
+        if (attributes.get('class') or '').split() == profile_image_class.split():
+            self.src = attributes.get('src')
+
+# Return the src of the profile photo on a player page, or None if the page doesn't have one.
+# The page is parsed a piece at a time and parsing stops as soon as the photo is found.
+def extract_profile_image_src(page_text):
+    parser = ProfileImageParser()
+
+    for start in range(0, len(page_text), parser_chunk_size):
+        parser.feed(page_text[start:start + parser_chunk_size])
+        if parser.src is not None:
+            return parser.src
+
+    parser.close()
+    return parser.src
+
+# The original approach to extract_profile_image_src(), parsing the whole page with BeautifulSoup.
+def extract_profile_image_src_with_soup(page_text):
+    page_html = BeautifulSoup(page_text, 'html.parser')
+    picture_section = page_html.find('img', {'class': profile_image_class})
+    return picture_section['src'] if picture_section is not None else None
+
+# Return the HTML of the last table row on a player stats page, or None if the page has no table rows.
+# Only the text after the last '<tr' is looked at, so the rest of the page is never parsed.
+def extract_last_table_row(page_text):
+    row_start = page_text.rfind('<tr')
+
+    if row_start == -1:
+        return extract_last_table_row_with_soup(page_text)
+
+    row_end = page_text.find('</tr>', row_start)
+    if row_end == -1:
+        # The last row isn't closed, so let BeautifulSoup work out where it ends.
+        return extract_last_table_row_with_soup(page_text)
+
+    return page_text[row_start:row_end + len('</tr>')]
+
+# The original approach to extract_last_table_row(), parsing only the page's table rows with BeautifulSoup.
+def extract_last_table_row_with_soup(page_text):
+    table_rows = BeautifulSoup(page_text, 'html.parser', parse_only=SoupStrainer('tr')).find_all('tr')
+    return str(table_rows[-1]) if table_rows else None
+
+# Matches a line break tag that isn't written in the self-closing '<br/>' form.
+line_break_regex = re.compile(r'<br\s*/?>')
+
+# Normalize a feed entry's description to the form BeautifulSoup would output, which is what the rest of the transaction parsing expects.
+# Descriptions without character references only need their line breaks rewritten, the rest go through BeautifulSoup.
+def decode_description(description):
+    if '&' not in description:
+        return line_break_regex.sub('<br/>', description)
+
+    return decode_description_with_soup(description)
+
+# The original approach to decode_description(), round-tripping the whole description through BeautifulSoup.
+def decode_description_with_soup(description):
+    return str(BeautifulSoup(description, features='html.parser'))
+
+# Matches the transaction ID at the end of a feed entry's guid.
+transaction_guid_regex = re.compile(r'/t/(\d*)')
+
+# Matches a whole decoded transaction description laid out the way EliteProspects usually writes it (Status, Date, Player, then optionally
+# From, To and Information, one per line), capturing every field at once.
+transaction_description_regex = re.compile(
+    r'Status: (?P<status>.*)<br/>\n'
+    r'Date: (?P<date>.*)<br/>\n'
+    r'Player: <a href="(?P<player_url>https://www\.eliteprospects\.com/player/(?P<player_id>\d+)/[^"]*|[^"]*)".*<br/>'
+    r'(?:\nFrom: (?:<a href="https://www\.eliteprospects\.com/team/(?P<origin_team_id>\d*)/)?.*<br/>)?'
+    r'(?:\nTo: (?:<a href="https://www\.eliteprospects\.com/team/(?P<destination_team_id>\d*)/)?.*<br/>)?'
+    r'(?:\nInformation: (?P<information>.*)<br/>)?\s*')
+
+# Matches each 'Name: value<br/>' line of a decoded transaction description, capturing the field's name and value.
+description_field_regex = re.compile(r'^(Status|Date|Player|From|To|Information): (.*)<br/>', re.MULTILINE)
+
+# Matches the first link in a description field and captures its URL, and an EliteProspects team page URL and its team ID.
+link_regex = re.compile(r'<a href="([^"]*)"')
+team_url_regex = re.compile(r'https://www\.eliteprospects\.com/team/(\d*)/')
+
+# A feed entry's transaction, parsed once so matching, classification and message building don't need to search the description again.
+# Fields that are missing from the description are None.
+class TransactionRecord:
+    __slots__ = ('transaction_id', 'title', 'description', 'status', 'date', 'player_url', 'player_id', 'origin_team_id', 'destination_team_id',
+                 'information')
+
+    def __init__(self, transaction_id, title, description):
+        self.transaction_id = transaction_id
+        self.title = title
+        self.description = description
+        self.status = None
+        self.date = None
+        self.player_url = None
+        self.player_id = None
+        self.origin_team_id = None
+        self.destination_team_id = None
+        self.information = None
+
+# Parse a feed entry's guid, title and (not yet decoded) description into a TransactionRecord. A description in the usual layout is
+# parsed by a single match, anything else by going over its lines once.
+def parse_transaction(guid, title, description):
+    guid_match = transaction_guid_regex.search(guid)
+    record = TransactionRecord(guid_match.group(1) if guid_match else None, title, decode_description(description))
+
+    description_match = transaction_description_regex.fullmatch(record.description)
+    if description_match:
+        record.status, record.date, record.player_url, record.player_id, record.origin_team_id, record.destination_team_id, record.information = \
+            description_match.group('status', 'date', 'player_url', 'player_id', 'origin_team_id', 'destination_team_id', 'information')
+        return record
+
+    for field_match in description_field_regex.finditer(record.description):
+        field, value = field_match.groups()
+
+        if field == 'Status' and record.status is None:
+            record.status = value
+        elif field == 'Date' and record.date is None:
+            record.date = value
+        elif field == 'Information' and record.information is None:
+            record.information = value
+        elif field == 'Player' and record.player_url is None:
+            link_match = link_regex.search(value)
+            if link_match:
+                record.player_url = link_match.group(1)
+                record.player_id = get_player_id(record.player_url)
+        elif field in ('From', 'To'):
+            team_match = team_url_regex.search(value)
+            if team_match and field == 'From' and record.origin_team_id is None:
+                record.origin_team_id = team_match.group(1)
+            elif team_match and field == 'To' and record.destination_team_id is None:
+                record.destination_team_id = team_match.group(1)
+
+    return record
@@ -0,0 +1,65 @@
+import json
+import os
+import re
+
+# Matches a single column range like 'Sheet Name'!B:B and captures the tab name (with any single quotes in it doubled) and column letter.
+column_range_regex = re.compile(r"^'((?:[^']|'')*)'!([A-Z]+):\2$")
+
+# Convert a column letter (A, B, ..., Z, AA, ...) to its zero-based index.
+def column_letter_to_index(column_letter):
+    column_index = 0
+
+    for letter in column_letter:
+        column_index = column_index * 26 + (ord(letter) - ord('A') + 1)
+
+    return column_index - 1
+
+# A stand-in for the Google Sheets API service that answers from local JSON files, so the transfers watcher can be run offline.
+# Each spreadsheet is a file named <spreadsheet ID>.json in the given directory, mapping tab names to their rows of cell values
+# (the same shape as the 'values' of a Sheets API response).
+class FakeSheetsService:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension='ROWS'):
+        return FakeBatchGetRequest(os.path.join(self.directory, spreadsheetId + '.json'), ranges, majorDimension)
+
+# A stand-in for a values.batchGet request. Only single column ranges read by column are supported, since that's all the watcher asks for.
+class FakeBatchGetRequest:
+    def __init__(self, path, ranges, major_dimension):
+        self.path = path
+        self.ranges = ranges
+        self.major_dimension = major_dimension
+
+    def execute(self, http=None, num_retries=0):
+        if self.major_dimension != 'COLUMNS':
+            raise ValueError('The fake Sheets backend only supports reading by column')
+
+        with open(self.path, 'r') as spreadsheet_file:
+            tabs = json.load(spreadsheet_file)
+
+        value_ranges = []
+        for requested_range in self.ranges:
+            match = column_range_regex.match(requested_range)
+            if not match:
+                raise ValueError('The fake Sheets backend only supports single column ranges, not %s' % requested_range)
+
+            column_index = column_letter_to_index(match.group(2))
+            column = [row[column_index] if column_index < len(row) else '' for row in tabs.get(match.group(1).replace("''", "'"), [])]
+
+            # Like the real API, leave out trailing empty cells, and the values entirely if the column is empty.
+            while column and column[-1] == '':
+                column.pop()
+
+            value_range = {'range': requested_range, 'majorDimension': 'COLUMNS'}
+            if column:
+                value_range['values'] = [column]
+            value_ranges.append(value_range)
+
+        return {'spreadsheetId': os.path.splitext(os.path.basename(self.path))[0], 'valueRanges': value_ranges}
@@ -0,0 +1,64 @@
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import run_metrics
+
+# Seconds to wait when connecting to a host and when waiting for its response before giving up on a request.
+request_timeout = (5, 30)
+
+# Maximum number of requests in flight at once, in total and against any single host.
+max_workers = 8
+max_requests_per_host = 4
+
+# A single keep-alive session shared by every request, so repeated fetches from EliteProspects reuse open connections.
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers))
+session.mount('http://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers))
+
+# Count the requests made through the session, and the bytes and latency of their responses, in the run's metrics.
+session.hooks['response'].append(run_metrics.record_response)
+
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+# Return the semaphore limiting how many requests may be made to the URL's host at the same time.
+def get_host_semaphore(url):
+    host = urllib.parse.urlsplit(url).netloc
+
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(max_requests_per_host)
+
+        return host_semaphores[host]
+
+# Fetch a URL over the shared session, waiting for a free slot if its host is already at its concurrency limit.
+def fetch(url, headers=None):
+    with get_host_semaphore(url):
+        return session.get(url, headers=headers, timeout=request_timeout)
+
+# Returned by fetch_all() in place of the result of an item whose call raised an exception.
+class FetchFailure:
+    def __init__(self, item, error):
+        self.item = item
+        self.error = error
+
+# Call the given function on each item using a bounded pool of worker threads. Results are returned in the same order as the items.
+# An item that fails doesn't stop the others: the error is logged and a FetchFailure is returned in its place.
+def fetch_all(function, items):
+    items = list(items)
+
+    if len(items) == 0:
+        return []
+
+    def call(item):
+        try:
+            return function(item)
+        except Exception as err:
+            print('Fetching one of %d items failed, continuing with the rest: %r' % (len(items), err))
+            run_metrics.increment('fetch_failures')
+            return FetchFailure(item, err)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
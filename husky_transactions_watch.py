@@ -1,40 +1,74 @@
 import datetime
+import json
+import os
 import re
+import sqlite3
+import time
 import feedparser
 import requests
-from links_and_paths import webhook_url, transaction_ids_path
-from discord_webhook import DiscordWebhook
-from bs4 import BeautifulSoup
-
-# This list is used to check if transaction Michigan Tech is involved in is a player transferring to/from another university.
-ncaa_d1_team_ids = ['2453', '1252', '18066', '1273', '35387', '790',  '2319', '911',  '633',   '1214',  '1320',  '1583', '685',
+from http_fetch import fetch, fetch_all, FetchFailure
+from ep_parsing import build_player_id_index, parse_transaction, extract_last_table_row, extract_profile_image_src, extract_profile_image_src_with_soup
+from player_cache import PlayerCache
+import run_metrics
+from links_and_paths import transaction_ids_path
+from discord_outbox import DiscordOutbox
+from watched_teams import get_watched_teams, build_team_id_index, get_team_alert_key, legacy_team_id
+from bs4 import BeautifulSoup, SoupStrainer
+
+# This set is used to check if transaction a watched team is involved in is a player transferring to/from another university.
+ncaa_d1_team_ids = frozenset(['2453', '1252', '18066', '1273', '35387', '790',  '2319', '911',  '633',   '1214',  '1320',  '1583', '685',
                     '913',  '1859', '706',   '840',  '1917',  '728',  '1339', '1792', '35273', '30556', '1866',  '1871', '1248',
                     '1157', '548',  '1520',  '2110', '1465',  '925',  '1549', '2118', '1551',  '713',   '2078',  '2039', '1543',
                     '1758', '2299', '773',   '1772', '4991',  '1038', '1366', '1915', '2071',  '1362',  '2034',  '606',  '1074',
-                    '803',  '776',  '1794',  '708',  '1136',  '1137', '1554', '2745', '710',   '452',   '1250',  '786']
+                    '803',  '776',  '1794',  '708',  '1136',  '1137', '1554', '2745', '710',   '452',   '1250',  '786'])
+
+# The EliteProspects RSS feed listing the most recent transactions.
+transfers_feed_url = 'https://www.eliteprospects.com/rss/transfers'
+
+# How long a downloaded copy of a team's 'Where are they now' player list is used before checking the page for changes again.
+player_page_links_ttl = datetime.timedelta(hours=12)
 
-# This method parses a transaction's description section and assembles the string representing the message to be published.
-def construct_message(title, decoded_description, type):
-    # Parse out the sections of the description we're interested in.
-    details = re.search(r'(Status: .*)<br/>\nDate: .*<br/>\nPlayer: <a href=\"(.*)\">', decoded_description)
-    status = details.group(1)
-    ep_player_page = details.group(2)
+# How long a published transaction is remembered, and the format its publish time is stored in (this sorts chronologically as a string).
+transaction_retention = datetime.timedelta(days=14)
+transaction_datetime_format = '%Y-%m-%d %H:%M:%S.%f'
 
+# How long each piece of information about a player is cached for, and how many players the cache holds at most. A player's classification
+# (cached separately for each team, as classification:<team ID>) expires quickly since a future player becomes a current one once their
+# season with the team starts.
+player_cache_ttls = {'classification': datetime.timedelta(days=1), 'picture_link': datetime.timedelta(days=30)}
+player_cache_max_players = 2000
+
+# This method assembles the string representing the message to be published to a team's webhook from a parsed transaction.
+def construct_message(team, record, type):
     # Assemble the formatted string.
-    message = '__***MTU Hockey %s Alert***__\n%s\n%s' % (type, title, status)
+    message = '__***%s %s Alert***__\n%s\nStatus: %s' % (team['alert_prefix'], type, record.title, record.status)
 
     # If the transaction's description has 'additional information' (not all will have this), add it onto the message.
-    if re.search(r'Information:', decoded_description):
-        information = re.search(r'(Information: .*)<br/>', decoded_description).group(1)
-        message += ('\n' + information)
+    if record.information is not None:
+        message += ('\nInformation: ' + record.information)
+
+    # The player may not be linked (for a player without an EliteProspects page), in which case there's no page to point to.
+    if record.player_url is not None:
+        message += ('\n[EliteProspects Player Page](<%s>)' % (record.player_url))
+
+    return message
 
-    message += ('\n[EliteProspects Player Page](<%s>)' % (ep_player_page))
+# Find the profile photo on a player's EliteProspects page. Returns None if the player's page does not have one.
+# An error response raises instead, so it isn't mistaken for a page without a photo (and cached as one).
+def get_player_picture_link(ep_player_page):
+    ep_player_page_data = fetch(ep_player_page)
+    ep_player_page_data.raise_for_status()
 
-    # Attach the player page's profile photo to the message if it exists.
-    ep_player_page_data = requests.get(ep_player_page)
-    ep_player_page_html = BeautifulSoup(ep_player_page_data.text, 'html.parser')
-    ep_player_page_picture_section = ep_player_page_html.find('img', {'class': 'ProfileImage_profileImage__JLd31 ProfileImage_playerImage__1fLtE'})
-    ep_player_picture_link = ep_player_page_picture_section['src']
+    # Only parse as much of the page as it takes to find the photo, falling back on a full parse if it can't be found that way.
+    with run_metrics.stage('player page parse'):
+        ep_player_picture_link = extract_profile_image_src(ep_player_page_data.text)
+        if ep_player_picture_link is None:
+            run_metrics.increment('player_page_full_parses')
+            ep_player_picture_link = extract_profile_image_src_with_soup(ep_player_page_data.text)
+
+    if ep_player_picture_link is None:
+        # The player's page does not have a profile photo section at all.
+        return None
 
     if 'https:' not in ep_player_picture_link:
             ep_player_picture_link = 'https:' + ep_player_picture_link
@@ -42,162 +76,386 @@ def construct_message(title, decoded_description, type):
     if ep_player_picture_link != 'https://cdn.eliteprospects.com/icons/placeholders/player-logo.svg':
         # The player's page has a profile photo.
         print(ep_player_picture_link)
-        return message, ep_player_picture_link
+        return ep_player_picture_link
     else:
         # The player's page does not have a profile photo.
-        return message, None
-
-# For a given transaction, delegate the message construction to construct_message() and publish it.
-def send_transaction_to_discord(transaction_id, title, decoded_description, type):
-    # Assamble the message to be published.
-    message, player_picture_path = construct_message(title, decoded_description, type)
-
-    # Attach the player's image if it exists.
-    if player_picture_path is not None:
-        webhook = DiscordWebhook(url=webhook_url, content=message, embeds=[{ 'image': { 'url': player_picture_path } }])
-    else:
-        webhook = DiscordWebhook(url=webhook_url, content=message)
-
-    # Publish the message and optional image to Discord.
-    webhook.execute()
-
-    # Record the transaction's ID so we know not to publish it again it we still see it later on.
-    with open(transaction_ids_path + 'transaction_ids.txt', 'a') as transaction_ids_file:
-        date_and_time = datetime.datetime.now()
-        transaction_ids_file.write(transaction_id + ',' + str(date_and_time) + '\n')
-        transaction_ids_file.flush()
-
-# Assemble a list of EliteProspects player page URLs representing future and former Michigan Tech players.
-# This information will come from Michigan Tech's 'Where are they now' page.
-def get_player_page_links():
-    page_data = requests.get('https://www.eliteprospects.com/team/548/michigan-tech/where-are-they-now?sort=tp')
-    page_html = BeautifulSoup(page_data.text, 'html.parser')
+        return None
+
+# The key a transaction is recorded under once it has been published for a team.
+def get_transaction_key(team, transaction_id):
+    return '%s:%s' % (team['team_id'], transaction_id)
+
+# Queue an assembled transaction message, along with the player's photo if it exists, to be published to the team's Discord webhook.
+def send_transaction_to_discord(transaction_store, outbox, team, transaction_id, message, player_picture_path):
+    transaction_key = get_transaction_key(team, transaction_id)
+    if transaction_already_published(transaction_store, transaction_key):
+        # Another invocation running at the same time published this transaction after we started.
+        return
+
+    # The transaction's key is recorded once Discord confirms receiving the message, by deliver_transactions().
+    outbox.enqueue(get_team_alert_key(team, 'transaction:' + transaction_id), team['webhook_url'], message, player_picture_path, transaction_key)
+
+# Open the queue of alerts waiting to be published to Discord.
+def open_outbox():
+    outbox = DiscordOutbox(transaction_ids_path + 'discord_outbox.db', 'transactions')
+
+    # Alerts queued before several teams could be watched were all about the legacy team.
+    outbox.adopt_alerts('transaction:')
+    outbox.add_key_prefix('transaction:', 'team:%s:' % legacy_team_id)
+    return outbox
+
+# Publish every queued alert to Discord, recording each transaction's key once its alert has been delivered so we know not to publish it
+# again if we still see it later on.
+def deliver_transactions(transaction_store, outbox):
+    # Record each transaction as published once Discord confirms receiving its alert.
+    def record_delivered_transactions(transaction_keys):
+        for transaction_key in transaction_keys:
+            record_published_transaction(transaction_store, transaction_key, datetime.datetime.now())
+
+    with run_metrics.stage('dispatch'):
+        outbox.deliver(record_delivered_transactions)
+
+# Pull the list of player page URLs for all future and former players out of a downloaded 'Where are they now' page.
+def extract_player_page_links(page_text):
+    # Only the tables of players need to be parsed, not the rest of the page.
+    page_html = BeautifulSoup(page_text, 'html.parser', parse_only=SoupStrainer('div', class_='expandable-table-wrapper'))
     page_player_tables = page_html.select('div.expandable-table-wrapper')
 
-    # Create a list of player page URLs for all future and former players on Michigan Tech's 'Where Are They Now?' page.
-    player_page_urls = re.findall(r'<a href=\"(https://www\.eliteprospects\.com/player/\d*/.*)\">.*</a>', str(page_player_tables))
+    # Create a list of player page URLs for all future and former players on a team's 'Where Are They Now?' page.
+    return re.findall(r'<a href=\"(https://www\.eliteprospects\.com/player/\d*/.*)\">.*</a>', str(page_player_tables))
+
+# Load the player lists saved by a previous invocation, keyed by the URL of the 'Where are they now' page each came from.
+def load_player_page_links_cache():
+    try:
+        with open(transaction_ids_path + 'player_page_links.json', 'r') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+    if 'urls' in cache:
+        # A single team's list saved before several teams could be watched. It's downloaded again instead.
+        return {}
+
+    return cache
+
+# Save the player lists along with the validators needed to make a conditional request for each of them later on.
+def save_player_page_links_cache(cache):
+    run_metrics.write_atomically(transaction_ids_path + 'player_page_links.json', json.dumps(cache))
+
+# Assemble a list of EliteProspects player page URLs representing a team's future and former players.
+# This information will come from the team's 'Where are they now' page. Since the page rarely changes, the list is cached on disk and
+# only re-checked once it's older than player_page_links_ttl, using a conditional request so an unchanged page isn't downloaded again.
+# Takes the list cached for the page (or None) and returns the list along with what should be cached for the page now.
+def get_player_page_links(player_page_links_url, cache, script_invocation_time):
+    if cache is not None and script_invocation_time - datetime.datetime.fromisoformat(cache['checked_at']) < player_page_links_ttl:
+        # The cached list is recent enough to use as-is.
+        run_metrics.increment('roster_cache_hits')
+        return cache['urls'], cache
+
+    headers = {}
+    if cache is not None:
+        if cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        if cache.get('last_modified'):
+            headers['If-Modified-Since'] = cache['last_modified']
+
+    try:
+        page_data = fetch(player_page_links_url, headers=headers)
+        page_data.raise_for_status()
+    except requests.RequestException as err:
+        if cache is None:
+            raise
+
+        # If EliteProspects can't be reached, fall back on the list we saved last time.
+        print('Using the cached player list, %s could not be fetched: %s' % (player_page_links_url, err))
+        run_metrics.increment('roster_cache_fallbacks')
+        return cache['urls'], cache
+
+    if page_data.status_code == 304:
+        # The page hasn't changed since we last downloaded it, so keep using the saved list.
+        run_metrics.increment('roster_cache_not_modified')
+        return cache['urls'], dict(cache, checked_at=script_invocation_time.isoformat())
+
+    with run_metrics.stage('roster parse'):
+        player_page_urls = extract_player_page_links(page_data.text)
+
+    if len(player_page_urls) == 0 and cache is not None:
+        # An empty list most likely means the page didn't load properly, so don't overwrite a good list with it.
+        print('Using the cached player list, no players were found on %s' % player_page_links_url)
+        run_metrics.increment('roster_cache_fallbacks')
+        return cache['urls'], cache
+
+    run_metrics.increment('roster_downloads')
     print(player_page_urls)
-    return player_page_urls 
-
-# Assemble list of transaction IDs representing transactions published less than 14 days ago.
-# Remove lines from transaction_ids.txt representing transactions that are at least 14 days old.
-def update_transaction_ids_file():
-    # List of transaction IDs that we've published less than 14 days ago.
-    transaction_ids_list = []
+    return player_page_urls, {
+        'urls': player_page_urls,
+        'etag': page_data.headers.get('ETag'),
+        'last_modified': page_data.headers.get('Last-Modified'),
+        'checked_at': script_invocation_time.isoformat()
+    }
+
+# Build an index from player ID to the watched teams the player is a future or former player of. Each team's 'Where are they now' page
+# is only fetched once even if several teams share it, and the pages are fetched at the same time.
+def get_roster_index(watched_teams):
+    cache = load_player_page_links_cache()
     script_invocation_time = datetime.datetime.now()
 
-    # Loop through each transaction listed in transaction_ids.txt to determine if we still need to keep track of it.
+    player_page_links_urls = list(dict.fromkeys(team['roster_url'] for team in watched_teams))
+    player_page_links = fetch_all(lambda url: get_player_page_links(url, cache.get(url), script_invocation_time), player_page_links_urls)
+
+    for url_player_page_links in player_page_links:
+        if isinstance(url_player_page_links, FetchFailure):
+            # Matching against an incomplete roster could miss transactions for good, so give up on this run like before.
+            raise url_player_page_links.error
+
+    for url, (_, url_cache) in zip(player_page_links_urls, player_page_links):
+        cache[url] = url_cache
+    save_player_page_links_cache(cache)
+
+    player_id_indexes = {url: build_player_id_index(player_page_urls) for url, (player_page_urls, _) in zip(player_page_links_urls, player_page_links)}
+    roster_index = {}
+    for team in watched_teams:
+        for player_id in player_id_indexes[team['roster_url']]:
+            roster_index.setdefault(player_id, []).append(team)
+
+    return roster_index
+
+# Open the database keeping track of which transactions have been published, creating it if needed.
+# SQLite's locking makes it safe for two invocations to use the database at the same time.
+def open_transaction_store():
+    transaction_store = sqlite3.connect(transaction_ids_path + 'transaction_ids.db', timeout=30)
+    transaction_store.execute('PRAGMA journal_mode=WAL')
+
+    with transaction_store:
+        transaction_store.execute('CREATE TABLE IF NOT EXISTS published_transactions (transaction_id TEXT PRIMARY KEY, published_at TEXT NOT NULL)')
+        transaction_store.execute('CREATE INDEX IF NOT EXISTS published_transactions_published_at ON published_transactions (published_at)')
+
+    migrate_transaction_ids_file(transaction_store)
+    return transaction_store
+
+# Copy the transactions recorded in the old transaction_ids.txt file into the database. This only happens once, since the file is renamed afterwards.
+def migrate_transaction_ids_file(transaction_store):
+    if not os.path.exists(transaction_ids_path + 'transaction_ids.txt'):
+        return
+
     with open(transaction_ids_path + 'transaction_ids.txt', 'r') as transaction_ids_file:
         transaction_ids_file_lines = transaction_ids_file.readlines()
 
-    # Clear the transaction_ids.txt file and only write back the lines whose transactions we still want to keep track of.
-    with open(transaction_ids_path + 'transaction_ids.txt', 'w') as transaction_ids_file:
+    with transaction_store:
         for line in transaction_ids_file_lines:
             # For each line in the file, parse out it's transaction ID and date it was put into the file.
-            line_parts = re.search(r'(\d*),(.*)', line)
-            transaction_id = line_parts.group(1)
+            line_parts = re.search(r'(\d+),(.*)', line)
+            if not line_parts:
+                continue
+
             transaction_datetime = datetime.datetime.strptime(line_parts.group(2), '%Y-%m-%d %H:%M:%S.%f')
+            transaction_store.execute('INSERT OR IGNORE INTO published_transactions VALUES (?, ?)',
+                                      (line_parts.group(1), transaction_datetime.strftime(transaction_datetime_format)))
+
+    try:
+        os.replace(transaction_ids_path + 'transaction_ids.txt', transaction_ids_path + 'transaction_ids.txt.migrated')
+    except FileNotFoundError:
+        # Another invocation migrated the file at the same time.
+        pass
+
+# Assemble the set of transaction keys (from get_transaction_key()) representing transactions published less than 14 days ago.
+# Transactions that are at least 14 days old are removed from the database.
+def load_published_transaction_ids(transaction_store):
+    oldest_kept = datetime.datetime.now() - transaction_retention
+
+    with transaction_store:
+        transaction_store.execute('DELETE FROM published_transactions WHERE published_at < ?', (oldest_kept.strftime(transaction_datetime_format),))
+
+        # Transactions recorded before several teams could be watched (including ones migrated from transaction_ids.txt) were published for the legacy team.
+        transaction_store.execute("UPDATE OR IGNORE published_transactions SET transaction_id = ? || ':' || transaction_id WHERE instr(transaction_id, ':') = 0",
+                                  (legacy_team_id,))
+
+    return {row[0] for row in transaction_store.execute('SELECT transaction_id FROM published_transactions')}
+
+# Check the database directly for a transaction, in case it was published after load_published_transaction_ids() was called.
+def transaction_already_published(transaction_store, transaction_key):
+    return transaction_store.execute('SELECT 1 FROM published_transactions WHERE transaction_id = ?', (transaction_key,)).fetchone() is not None
+
+# Record that a transaction was published at the given time.
+def record_published_transaction(transaction_store, transaction_key, published_at):
+    with transaction_store:
+        transaction_store.execute('INSERT OR IGNORE INTO published_transactions VALUES (?, ?)', (transaction_key, published_at.strftime(transaction_datetime_format)))
+
+# Decide whether a future or former player of a team is involved in a transaction by looking at their stats table.
+def classify_player(team, player_id):
+    # If the last row of the player's stats table names the team and there are no numbers (hyphens in all stat columns),
+    # then we know they're a future player. Otherwise, they're a former player.
+    # An error response raises instead of being read as an empty table, which would make every player look like a former player.
+    player_page_data = fetch('https://www.eliteprospects.com/iframe_player_stats.php?player=' + player_id)
+    player_page_data.raise_for_status()
+    with run_metrics.stage('stats iframe parse'):
+        last_row = extract_last_table_row(player_page_data.text) or ''
+    dashed_column_count = last_row.count('>-<')
+
+    if team['name'] in last_row and dashed_column_count == 5:
+        # The player is a future player of the team.
+        return 'Future Player'
+    else:
+        # The player is a former player of the team.
+        return 'Former Player'
 
-            # If the transaction is older than 14 days, don't bother keeping track of it anymore.
-            time_difference = script_invocation_time - transaction_datetime
-            if time_difference.days >= 14:
-                continue
+# Open the cache of player classifications and photo links saved by previous invocations.
+def open_player_cache():
+    return PlayerCache(transaction_ids_path + 'player_cache.json', player_cache_ttls, player_cache_max_players)
+
+# For a matched transaction, classify the player if needed and look up their profile photo, using the player cache where possible.
+# A player's classification is cached for each team, but their photo link is shared by every team.
+# Returns the team, the transaction's ID, the message to publish and the photo link (or None, also when the player isn't linked).
+def resolve_match(player_cache, match):
+    record, team, match_type = match
+
+    if match_type == '':
+        match_type = player_cache.get(record.player_id, 'classification:' + team['team_id'], lambda: classify_player(team, record.player_id))
+
+    message = construct_message(team, record, match_type)
+
+    if record.player_url is None:
+        # Without a link to the player's page, there's no photo to look up.
+        return team, record.transaction_id, message, None
+
+    if record.player_id is None:
+        return team, record.transaction_id, message, get_player_picture_link(record.player_url)
 
-            # If we published the transaction less than 14 days ago, continue to keep track of it.
-            transaction_ids_list.append(transaction_id)
-            transaction_ids_file.write(line)
-            transaction_ids_file.flush()
+    return team, record.transaction_id, message, player_cache.get(record.player_id, 'picture_link', lambda: get_player_picture_link(record.player_url))
 
-    return transaction_ids_list
+# Query the EliteProspects transfers RSS feed. If the ETag and Last-Modified values from a previous query are given, EliteProspects can
+# answer with a 304 (and no entries) when the feed hasn't changed since then.
+# The feed is downloaded through the shared session (so the request shows up in the run's metrics) and then handed to feedparser.
+def fetch_feed(etag=None, modified=None):
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
 
-# This method examines each of the 50 most recent entries in the EliteProspects RSS transaction for mentions of Michigan Tech.
-def process_feed(player_page_urls, transaction_ids_list):
-    # Query the EliteProspects transfers RSS feed.
-    feed = feedparser.parse('https://www.eliteprospects.com/rss/transfers')
+    with run_metrics.stage('feed fetch'):
+        feed_data = fetch(transfers_feed_url, headers=headers)
+
+    if feed_data.status_code == 304:
+        return feedparser.FeedParserDict(status=304, entries=[], etag=etag, modified=modified)
+
+    with run_metrics.stage('feed parse'):
+        feed = feedparser.parse(feed_data.content, response_headers={header.lower(): value for header, value in feed_data.headers.items()})
+
+    feed['status'] = feed_data.status_code
+    feed['etag'] = feed_data.headers.get('ETag')
+    feed['modified'] = feed_data.headers.get('Last-Modified')
+    return feed
+
+# This method examines each of the 50 most recent entries in the EliteProspects RSS transaction for mentions of the watched teams.
+# Each entry is parsed once and routed to every team it concerns, through an index of the teams by ID and the roster index from get_roster_index().
+# The feed is queried here unless one that was already fetched is passed in. Returns whether every matched transaction could be queued.
+def process_feed(transaction_store, outbox, player_cache, watched_teams, roster_index, published_transaction_ids, feed=None):
+    if feed is None:
+        feed = fetch_feed()
 
     if len(feed) == 0:
         raise Exception('The list of RSS feed entries is 0')
 
-    # In each the RSS feed's 50 most recent transactions, look for mentions of future, current, or former Michigan Tech players.
-    for item in feed.entries:
-        transaction_id = re.search(r'/t/(\d*)', item.guid).group(1)
+    run_metrics.increment('feed_entries_scanned', len(feed.entries))
+    matching_start = time.perf_counter()
+    team_id_index = build_team_id_index(watched_teams)
 
-        if transaction_id in transaction_ids_list:
-            # If the transaction ID's transaction has already been published, move on to the next entry in the feed.
-            continue
+    # Transactions involving a watched team, in feed order. Each one is [transaction record, team, match type]. Players that still need to be
+    # classified as future or former players of the team have an empty match type.
+    matches = []
 
-        decoded_description = str(BeautifulSoup(item.description, features='html.parser'))
+    # In each the RSS feed's 50 most recent transactions, look for mentions of future, current, or former players of the watched teams.
+    for item in feed.entries:
+        # Everything needed from the entry is parsed out of it at once.
+        record = parse_transaction(item.guid, item.title, item.description)
 
-        if 'College transfer' in decoded_description:
+        if 'College transfer' in record.description:
             # If the transaction is labeled as an inter-university transfer, do not process it. Not all of them have this label, so that's why
             # there's checks later on to catch them when they're between two NCAA D1 teams. This IF statements helps catch a player's transfer
             # from a D1 team to a D3 team, or vice versa.
             continue
 
-        match_type = ''
-
-        if re.search(r'From: <a href="https:\/\/www\.eliteprospects\.com\/team\/548\/', decoded_description):
-            match = re.search(r'To: <a href="https:\/\/www\.eliteprospects\.com\/team\/(\d*)\/', decoded_description)
-            if match:
-                destination_team_id = match.group(1)
-                if destination_team_id in ncaa_d1_team_ids:
-                    # Do not process inter-university transfers in the EliteProspects transaction feed.
-                    # Instead, later on, look for these kinds of transactions in the transfer portal spreadsheets.
-                    continue
-
-            print(item.title)
-            print(decoded_description)
-
-            # A player is leaving Michigan Tech.
-            match_type = 'Departure'
-
-        elif re.search(r'To: <a href="https:\/\/www\.eliteprospects\.com\/team\/548\/', decoded_description):
-            match = re.search(r'From: <a href="https:\/\/www\.eliteprospects\.com\/team\/(\d*)\/', decoded_description)
-            if match:
-                origin_team_id = match.group(1)
-                if origin_team_id in ncaa_d1_team_ids:
-                    continue
-
-            print(item.title)
-            print(decoded_description)
-
-            # A player is joining Michigan Tech.
-            match_type = 'Arrival'
-        else:
-            # If Michigan Tech is not mentioned in the transaction, check to see if a future or former player is involved.
-            for url in player_page_urls:
-                if re.search(url, decoded_description):
-                    # A future or former Michigan Tech player is involved in this transaction.
-                    print(item.title)
-                    print(decoded_description)
-
-                    # Extract the player's ID from their profile URL.
-                    player_id_search = re.search(r'https://www\.eliteprospects\.com/player/(\d*)/', url)
-                    player_id = player_id_search.group(1)
-
-                    # If the last row of the player's stats table says 'Michigan Tech' and there are no numbers (hyphens in all stat columns),
-                    # then we know they're a future player. Otherwise, they're a former player.
-                    player_page_data = requests.get('https://www.eliteprospects.com/iframe_player_stats.php?player=' + player_id)
-                    player_page_html = BeautifulSoup(player_page_data.text, 'html.parser')
-                    page_body = player_page_html.find('body')
-                    table_rows = page_body.find_all('tr')
-                    last_row = table_rows[-1]
-                    dashed_columns = re.findall(r'>-<', str(last_row))
-
-                    if 'Michigan Tech' in str(last_row) and len(dashed_columns) == 5:
-                        # The player is a future Michigan Tech player.
-                        match_type = 'Future Player'
-                    else:
-                        # The player is a former Michigan Tech player.
-                        match_type = 'Former Player'
-
-        if match_type != '':
-            send_transaction_to_discord(transaction_id, item.title, decoded_description, match_type)
+        origin_team_id = record.origin_team_id
+        destination_team_id = record.destination_team_id
+
+        # The watched teams this transaction concerns, each with its match type.
+        team_matches = []
+
+        if origin_team_id in team_id_index:
+            # Do not process inter-university transfers in the EliteProspects transaction feed.
+            # Instead, in the transfers watcher, look for these kinds of transactions in the transfer portal spreadsheets.
+            if destination_team_id not in ncaa_d1_team_ids:
+                # A player is leaving a watched team.
+                team_matches.append((team_id_index[origin_team_id], 'Departure'))
+
+        if destination_team_id in team_id_index and destination_team_id != origin_team_id:
+            if origin_team_id not in ncaa_d1_team_ids:
+                # A player is joining a watched team.
+                team_matches.append((team_id_index[destination_team_id], 'Arrival'))
+
+        # For the watched teams that aren't mentioned in the transaction, check to see if one of their future or former players is involved.
+        for team in roster_index.get(record.player_id, ()):
+            if team['team_id'] not in (origin_team_id, destination_team_id):
+                # Whether they're a future or former player is decided later, along with the other matched transactions.
+                team_matches.append((team, ''))
+
+        for team, match_type in team_matches:
+            if get_transaction_key(team, record.transaction_id) in published_transaction_ids \
+                    or outbox.is_queued(get_team_alert_key(team, 'transaction:' + record.transaction_id)):
+                # If the transaction has already been published for this team (or is waiting to be), move on to the next team.
+                continue
+
+            print(record.title)
+            print(record.description)
+            matches.append([record, team, match_type])
+
+    run_metrics.add_stage_time('matching', time.perf_counter() - matching_start)
+    run_metrics.increment('feed_entries_matched', len(matches))
+
+    # Classify players and look up their profile photos for all matched transactions at the same time, then queue them in feed order.
+    player_cache_hits = sum(player_cache.hits.values())
+    player_cache_misses = sum(player_cache.misses.values())
+    with run_metrics.stage('classification and photos'):
+        resolved_matches = fetch_all(lambda match: resolve_match(player_cache, match), matches)
+
+    run_metrics.increment('player_cache_hits', sum(player_cache.hits.values()) - player_cache_hits)
+    run_metrics.increment('player_cache_misses', sum(player_cache.misses.values()) - player_cache_misses)
+
+    failed_matches = [resolved_match for resolved_match in resolved_matches if isinstance(resolved_match, FetchFailure)]
+    for resolved_match in resolved_matches:
+        if isinstance(resolved_match, FetchFailure):
+            # The transaction isn't recorded as published, so it's tried again on the next run.
+            continue
+
+        team, transaction_id, message, player_picture_path = resolved_match
+        send_transaction_to_discord(transaction_store, outbox, team, transaction_id, message, player_picture_path)
+
+    # Publish the queued alerts, along with any left over from previous invocations that couldn't be delivered.
+    deliver_transactions(transaction_store, outbox)
+
+    print('Player cache: %s' % player_cache.stats())
+    return len(failed_matches) == 0
 
 def main():
-    transaction_ids_list = update_transaction_ids_file()
-    player_page_urls = get_player_page_links()
-    process_feed(player_page_urls, transaction_ids_list)
+    run_metrics.start_run()
+    transaction_store = open_transaction_store()
+    outbox = open_outbox()
+    player_cache = open_player_cache()
+
+    try:
+        published_transaction_ids = load_published_transaction_ids(transaction_store)
+
+        watched_teams = get_watched_teams()
+        with run_metrics.stage('roster'):
+            roster_index = get_roster_index(watched_teams)
+
+        process_feed(transaction_store, outbox, player_cache, watched_teams, roster_index, published_transaction_ids)
+    finally:
+        player_cache.save()
+        outbox.close()
+        transaction_store.close()
+        run_metrics.finish_run('transactions', transaction_ids_path)
 
 if __name__ == '__main__': 
     main()
\ No newline at end of file
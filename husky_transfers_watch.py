@@ -1,25 +1,44 @@
+import hashlib
+import json
 import re
 import os.path
+import time
 from links_and_paths import *
-from discord_webhook import DiscordWebhook
+from discord_outbox import DiscordOutbox
+from fake_sheets import FakeSheetsService
+from http_fetch import fetch_all, FetchFailure
+import run_metrics
+from watched_teams import get_watched_teams, build_team_alias_index, get_team_alias_fingerprint, get_team_alert_key, legacy_team_id
+from google_auth_httplib2 import AuthorizedHttp
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 
-inter_university_transfers = []
-mtu_strings = ['Michigan Technological University', 'Michigan Tech']
+# The transfer portal spreadsheets to check. For each one: its spreadsheet ID, the tab to read, the first row with a transfer in it, and the
+# columns holding the origin team, the player's name and the destination team.
+portal_spreadsheets = [
+    (rink_live_spreadsheet_id, rink_live_tab_name, 2, 1, 0, 11),
+    (gopher_puck_live_shreadsheet_id, gopher_puck_live_tab_name, 1, 2, 1, 5),
+    (college_hockey_insider_spreadsheet_id, college_hockey_insider_tab_name, 19, 7, 1, 10)
+]
 
-# Access and load the data in a certain tab of the specified Google Sheets spreasheet.
-def get_portal_spreadsheet_data(spreadsheet_id, sheet_name):
-    scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+# Access to the Google Sheets API. The service and credentials are built once by get_sheets_service() and shared by every request.
+sheets_scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+sheets_num_retries = 5
+sheets_service = None
+sheets_credentials = None
+
+# Load the Google API credentials, letting the user log in if there are no valid ones saved.
+def get_sheets_credentials():
     creds = None
 
     # token.json stores the user's access and refresh tokens.
     # It's created automatically when the authorization flow completes for the first time.
     if os.path.exists(token_json_path + 'token.json'):
-        creds = Credentials.from_authorized_user_file(token_json_path + 'token.json', scopes)
+        creds = Credentials.from_authorized_user_file(token_json_path + 'token.json', sheets_scopes)
     
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
@@ -27,7 +46,7 @@ def get_portal_spreadsheet_data(spreadsheet_id, sheet_name):
             creds.refresh(Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file(
-                credentials_json_path + 'credentials.json', scopes
+                credentials_json_path + 'credentials.json', sheets_scopes
             )
             creds = flow.run_local_server(port=0)
 
@@ -35,31 +54,148 @@ def get_portal_spreadsheet_data(spreadsheet_id, sheet_name):
         with open(token_json_path + 'token.json', 'w') as token:
             token.write(creds.to_json())
             token.flush()
+
+    return creds
+
+# Return the Sheets API service and the credentials it uses, building them the first time this is called and reusing them afterwards.
+# If the HUSKYWATCH_FAKE_SHEETS_DIR environment variable is set, spreadsheets are read from JSON files in that directory instead (with no credentials).
+def get_sheets_service():
+    global sheets_service, sheets_credentials
+
+    if sheets_service is None:
+        if os.environ.get('HUSKYWATCH_FAKE_SHEETS_DIR'):
+            sheets_service = FakeSheetsService(os.environ['HUSKYWATCH_FAKE_SHEETS_DIR'])
+        else:
+            sheets_credentials = get_sheets_credentials()
+            sheets_service = build('sheets', 'v4', credentials=sheets_credentials, cache_discovery=False)
+
+    return sheets_service, sheets_credentials
+
+# Convert a zero-based column index to its column letter (A, B, ..., Z, AA, ...).
+def column_index_to_letter(column_index):
+    column_letter = ''
+    column_index += 1
+
+    while column_index > 0:
+        column_index, remainder = divmod(column_index - 1, 26)
+        column_letter = chr(ord('A') + remainder) + column_letter
+
+    return column_letter
+
+# Access and load the data in the given columns of a certain tab of the specified Google Sheets spreasheet. The rows are returned with
+# each value at its column's index (other columns are left empty), so they can be used as if the whole tab had been loaded.
+def get_portal_spreadsheet_data(spreadsheet_id, sheet_name, columns):
+    service, creds = get_sheets_service()
+    # Single quotes in the tab name are doubled, as A1 notation requires inside a quoted sheet name (like 'Men''s Portal'!B:B).
+    quoted_sheet_name = sheet_name.replace("'", "''")
+    ranges = ["'%s'!%s:%s" % (quoted_sheet_name, column_index_to_letter(column), column_index_to_letter(column)) for column in columns]
+
     try:
-        service = build('sheets', 'v4', credentials=creds)
-
-        # Call the Sheets API
-        sheet = service.spreadsheets()
-        result = (
-            sheet.values()
-            .get(spreadsheetId=spreadsheet_id, range=sheet_name)
-            .execute()
-        )
-        values = result.get('values', [])
-
-        if not values:
-            print('No data found.')
-            return []
-
-        return values
+        request = service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges, majorDimension='COLUMNS')
+
+        # The service object isn't thread-safe, so each request gets its own authorized connection. Requests that fail because of the
+        # API's quota (or a server error) are retried with exponential backoff. build_http() gives the connection the client library's
+        # default timeout, so a stalled connection can't hold up the watcher forever.
+        http = AuthorizedHttp(creds, http=build_http()) if creds is not None else None
+        request_start = time.perf_counter()
+        result = request.execute(http=http, num_retries=sheets_num_retries)
     except HttpError as err:
         print(err)
+        run_metrics.increment('sheets_errors')
         return []
 
-# Parse the provided data corresponding to a certain transfer portal spreadsheet. Look for mentions of players transferring to or from Michigan Tech and assemble a list of them.
-def process_portal_spreadsheet(portal_spreadsheet_data, starting_row, origin_team_column, player_name_column, destination_team_column):
+    # The Sheets client doesn't expose the raw response, so the size of the decoded values is recorded instead.
+    run_metrics.record_request('sheets.googleapis.com' if creds is not None else 'fake-sheets', len(json.dumps(result)), time.perf_counter() - request_start)
+
+    # Each range comes back as a single column. Columns that are entirely empty have no values.
+    column_values = [value_range.get('values', [[]])[0] for value_range in result.get('valueRanges', [])]
+    row_count = max([len(values) for values in column_values], default=0)
+
+    if row_count == 0:
+        print('No data found.')
+        return []
+
+    values = [[''] * (max(columns) + 1) for _ in range(row_count)]
+    for column, column_data in zip(columns, column_values):
+        for row_index, value in enumerate(column_data):
+            values[row_index][column] = value
+
+    return values
+
+# Build the key used to decide whether two mentions of a transfer are the same player: the first two letters of their first name and their
+# last name, ignoring case. A name that is a single word is treated as a last name. Returns None for a blank name.
+def get_player_key(player_name):
+    name_parts = player_name.lower().split(None, 1)
+
+    if len(name_parts) == 0:
+        return None
+    if len(name_parts) == 1:
+        return ('', name_parts[0])
+
+    return (name_parts[0][:2], name_parts[1].strip())
+
+# Build the key a transfer is kept under: the ID of the watched team it's about followed by get_player_key() of the player's name, so players
+# of different watched teams with similar names are never mistaken for each other. Returns None for a blank name.
+def get_transfer_key(team_id, player_name):
+    player_key = get_player_key(player_name)
+    return (team_id,) + player_key if player_key is not None else None
+
+# Split a line of published_transfers.txt into its transfer key and its parts (the player's name, origin team and destination team).
+# Lines start with the ID of the watched team the transfer is about, except those written before several teams could be watched,
+# which were all about the legacy team.
+def parse_published_transfer(published_transfer_line):
+    published_transfer_parts = re.split(',', published_transfer_line.rstrip())
+
+    if len(published_transfer_parts) > 3:
+        return get_transfer_key(published_transfer_parts[0], published_transfer_parts[1]), published_transfer_parts[1:]
+
+    return get_transfer_key(legacy_team_id, published_transfer_parts[0]), published_transfer_parts
+
+# Hash the cells of a row that the watcher reads, so a later invocation can tell whether the row changed.
+def get_row_hash(row, columns):
+    cells = [row[column] if column < len(row) else '' for column in columns]
+    return hashlib.sha1('\x1f'.join(cells).encode('utf-8')).hexdigest()[:16]
+
+# Load the snapshots of each spreadsheet saved by the previous invocation, keyed by get_snapshot_key().
+def load_portal_snapshots():
+    try:
+        with open(published_transfers_path + 'portal_snapshots.json', 'r') as snapshots_file:
+            return json.load(snapshots_file)
+    except (OSError, ValueError):
+        return {}
+
+# Save the snapshots of each spreadsheet for the next invocation.
+def save_portal_snapshots(portal_snapshots):
+    run_metrics.write_atomically(published_transfers_path + 'portal_snapshots.json', json.dumps(portal_snapshots))
+
+# The key a spreadsheet tab's snapshot is saved under.
+def get_snapshot_key(spreadsheet_id, sheet_name):
+    return '%s/%s' % (spreadsheet_id, sheet_name)
+
+# Parse the provided data corresponding to a certain transfer portal spreadsheet. Look for mentions of players transferring to or from any watched team
+# and add them to inter_university_transfers, a dictionary of transfers keyed by get_transfer_key(). Each row is looked at once, and its teams are
+# looked up in team_alias_index (from build_team_alias_index()).
+# If a snapshot from a previous invocation is given, rows whose contents are in it are skipped, so only new or changed rows are processed.
+# Returns the snapshot of the spreadsheet as it is now: its row count and the hash of each row.
+def process_portal_spreadsheet(inter_university_transfers, team_alias_index, portal_spreadsheet_data, starting_row, origin_team_column, player_name_column,
+                               destination_team_column, previous_snapshot=None):
+    columns = (origin_team_column, player_name_column, destination_team_column)
+    run_metrics.increment('sheet_rows_scanned', max(len(portal_spreadsheet_data) - starting_row, 0))
+    previous_row_hashes = set(previous_snapshot['row_hashes']) if previous_snapshot else set()
+    row_hashes = []
+
     # Loop through each row in the spreadsheet data.
     for row in portal_spreadsheet_data[starting_row:]:
+        # Rows are compared by content rather than position, so rows being inserted or re-sorted doesn't make the rest of the spreadsheet look changed.
+        row_hash = get_row_hash(row, columns)
+        row_hashes.append(row_hash)
+
+        if row_hash in previous_row_hashes:
+            # This row was already processed by a previous invocation and hasn't changed since.
+            continue
+
+        run_metrics.increment('sheet_rows_changed')
+
         # Handle situations where sometimes a row's columns are empty and represented as not part of the row instead of just an empty string.
         try:
             origin_team = row[origin_team_column].strip()
@@ -75,114 +211,190 @@ def process_portal_spreadsheet(portal_spreadsheet_data, starting_row, origin_tea
         except IndexError:
             destination_team = '?'
         
-        if origin_team in mtu_strings or destination_team in mtu_strings:
-            # If either the origin or destination team is Michigan Tech, use a common name to avoid saying 'Michigan Technological University'.
-            if origin_team in destination_team and re.search(r'withdrew|withdrawn', destination_team, re.IGNORECASE):
-                # A Michigan Tech player entered the transfer portal, but later withdrew and is returning to Michigan Tech.
-                origin_team = destination_team = 'Michigan Tech'
+        origin_watched_team = team_alias_index.get(origin_team)
+        destination_watched_team = team_alias_index.get(destination_team)
+
+        if origin_watched_team is not None or destination_watched_team is not None:
+            # If either the origin or destination team is watched, use the team's own name to avoid saying something like 'Michigan Technological University'.
+            if origin_watched_team is not None and origin_team in destination_team and re.search(r'withdrew|withdrawn', destination_team, re.IGNORECASE):
+                # A player entered the transfer portal, but later withdrew and is returning to their watched team.
+                origin_team = destination_team = origin_watched_team['name']
             else:
-                if origin_team in mtu_strings:
-                    origin_team = 'Michigan Tech'
-
-                if destination_team in mtu_strings:
-                    destination_team = 'Michigan Tech'
-
-            current_transfer = [row[player_name_column].strip(), origin_team, destination_team]
-            
-            # Split the player's name into a first and last name.        
-            current_first_last_name = current_transfer[0].split(' ', 1)
-
-            # Look for the player's name in our list transfers we've already compiled from other transfer portal spreadsheets.
-            already_present = False
-            for existing_transfer in inter_university_transfers:
-                # Split the current existing transfer's player name into it's first and last names.
-                existing_first_last_name = existing_transfer[0].split(' ', 1)
-
-                # If the current transfer has the same player first initial and last name as an entry in inter_university_transfers, we'll count that as a match.
-                if current_first_last_name[0][:2].lower() == existing_first_last_name[0][:2].lower() and current_first_last_name[1].lower() == existing_first_last_name[1].lower():
-                    already_present = True
-
-                    # We already saw this transfer in another transfer portal spreadsheet, check to see if it had a destination team listed.
-                    if current_transfer[2] != '?' and existing_transfer[2] == '?':
-                        # If the previous mention of this transfer didn't list a destination team, but this spreadsheet does, add it.
-                        existing_transfer[2] = current_transfer[2]
-
-                    break
-
-            # If this tranfer was not previously recorded, add it to our list of transfers to publish (as long as we didn't publish it in a previous invocation).
-            if not already_present:
-                inter_university_transfers.append(current_transfer)
-
-# Examine each transfer involving Michigan Tech that was gathered from the transfer portal spreadsheets. Send out a notification for any that haven't been
-# published yet or completed (published without a destination team).
-def send_transfers_to_discord():
-    # Gather a list of lines from the file keeping track of which transfers have already been published.
+                if origin_watched_team is not None:
+                    origin_team = origin_watched_team['name']
+
+                if destination_watched_team is not None:
+                    destination_team = destination_watched_team['name']
+
+            try:
+                current_transfer = [row[player_name_column].strip(), origin_team, destination_team]
+            except IndexError:
+                # There's no player name listed, so there's nothing to publish.
+                continue
+
+            # A transfer is about the watched team the player is leaving, or the one they're joining if they aren't leaving one.
+            transfer_team = origin_watched_team if origin_watched_team is not None else destination_watched_team
+            transfer_key = get_transfer_key(transfer_team['team_id'], current_transfer[0])
+            if transfer_key is None:
+                continue
+
+            # Look for the player's name in the transfers we've already compiled from other transfer portal spreadsheets.
+            # A player of the same watched team with the same first initial and last name as an entry in inter_university_transfers counts as a match.
+            existing_transfer = inter_university_transfers.get(transfer_key)
+
+            if existing_transfer is None:
+                # If this tranfer was not previously recorded, add it to our list of transfers to publish (as long as we didn't publish it in a previous invocation).
+                inter_university_transfers[transfer_key] = current_transfer
+            elif current_transfer[2] != '?' and existing_transfer[2] == '?':
+                # We already saw this transfer in another transfer portal spreadsheet, but it didn't list a destination team and this spreadsheet does, so add it.
+                existing_transfer[2] = current_transfer[2]
+
+    return {'row_count': len(portal_spreadsheet_data), 'row_hashes': row_hashes}
+
+# Load the transfers published in previous invocations from published_transfers.txt, keyed by get_transfer_key().
+# Each entry holds the line as it appears in the file and its parts.
+def load_published_transfers():
+    published_transfers = {}
+
     with open(published_transfers_path + 'published_transfers.txt', 'r') as published_transfers_file:
-        published_transfers_file_lines = published_transfers_file.readlines()
-
-    with open(published_transfers_path + 'published_transfers.txt', 'w') as published_transfers_file:
-        # For each transfer that identified in the portal spreadsheets, check if it exists in published_transfers.txt (it was already published).
-        for transfer in inter_university_transfers:
-            player_name = transfer[0]
-            origin_team = transfer[1]
-            destination_team = transfer[2]
-            current_first_last_name = player_name.split(' ', 1)
-            transfer_already_published = False
-
-            for published_transfer in published_transfers_file_lines:
-                # Separate each line from published_transfers.txt into an array of its parts.
-                published_transfer_parts = re.split(',', published_transfer.rstrip())
-
-                # Split already published tranfer's player name into a first and last name.
-                published_first_last_name = published_transfer_parts[0].split(' ', 1)
-
-                # If we find a matching transfer that was already published (having the same player first initial and last name), check if the previous publish was incomplete
-                # (didn't list a destination team). If it was, send it again to announce the destination team.
-                if current_first_last_name[0][:2].lower() == published_first_last_name[0][:2].lower() and current_first_last_name[1].lower() == published_first_last_name[1].lower():
-                    transfer_already_published = True
-                    
-                    # If the version of the transfer from published_transfers.txt listed '?' as the destination team, and the version that was identified in the latest invocation's
-                    # destination team is NOT unknown, send out a second, complete notification.
-                    if published_transfer_parts[2] == '?' and destination_team != '?':
-                        if origin_team == destination_team:
-                            # The player has withdrawn from the portal and returned to their origin team.
-                            message = '__***MTU Hockey Transfer Alert***__\n%s\'s %s has withdrawn from the transfer portal and returned to %s.' % (origin_team, player_name, destination_team)
-                        else:
-                            message = '__***MTU Hockey Transfer Alert***__\n%s\'s %s has transferred to %s.' % (origin_team, player_name, destination_team)
-                        
-                        webhook = DiscordWebhook(url=webhook_url, content=message)
-                        webhook.execute()
-
-                        # When recording this transfer in published_transfers.txt, we want it to be the version that is complete (lists a destination team).
-                        published_transfers_file.write('%s,%s,%s\n' % (player_name, origin_team, destination_team))
-                    else:
-                        published_transfers_file.write(published_transfer)
-
-                    published_transfers_file.flush()
-                    break
-
-            if not transfer_already_published:
-                # A new transfer has been identified, so publish a notification for it.
-                if destination_team == '?':
-                    message = '__***MTU Hockey Transfer Alert***__\n%s\'s %s has entered the transfer portal.' % (origin_team, player_name)
-                elif origin_team == destination_team:
-                    message = '__***MTU Hockey Transfer Alert***__\n%s\'s %s entered the transfer portal, but later withdrew to return to %s.' % (origin_team, player_name, destination_team)
+        for published_transfer in published_transfers_file:
+            # Separate each line from published_transfers.txt into an array of its parts.
+            transfer_key, published_transfer_parts = parse_published_transfer(published_transfer)
+
+            # If a player somehow appears more than once, the first line for them is the one that counts.
+            if transfer_key is not None and transfer_key not in published_transfers:
+                published_transfers[transfer_key] = (published_transfer, published_transfer_parts)
+
+    return published_transfers
+
+# Write the transfers that have been published back to published_transfers.txt.
+def save_published_transfers(published_transfers):
+    run_metrics.write_atomically(published_transfers_path + 'published_transfers.txt',
+                                 ''.join(published_transfer_line for published_transfer_line, _ in published_transfers.values()))
+
+# Examine each transfer involving a watched team that was gathered from the transfer portal spreadsheets. Send out a notification for any that haven't been
+# published yet or completed (published without a destination team), to the webhook of each watched team involved.
+def send_transfers_to_discord(outbox, watched_teams, inter_university_transfers):
+    team_name_index = {team['name']: team for team in watched_teams}
+
+    # Gather the transfers that have already been published.
+    published_transfers = load_published_transfers()
+
+    # For each transfer that identified in the portal spreadsheets, check if it exists in published_transfers.txt (it was already published).
+    for transfer_key, transfer in inter_university_transfers.items():
+        player_name = transfer[0]
+        origin_team = transfer[1]
+        destination_team = transfer[2]
+        published_transfer = published_transfers.get(transfer_key)
+        message = None
+
+        if published_transfer is not None:
+            published_transfer_parts = published_transfer[1]
+
+            # If we find a matching transfer that was already published (for the same watched team, having the same player first initial and last name), check if the previous publish was incomplete
+            # (didn't list a destination team). If it was, send it again to announce the destination team.
+            # If the version of the transfer from published_transfers.txt listed '?' as the destination team, and the version that was identified in the latest invocation's
+            # destination team is NOT unknown, send out a second, complete notification.
+            if published_transfer_parts[2] == '?' and destination_team != '?':
+                if origin_team == destination_team:
+                    # The player has withdrawn from the portal and returned to their origin team.
+                    message = '%s\'s %s has withdrawn from the transfer portal and returned to %s.' % (origin_team, player_name, destination_team)
                 else:
-                    message = '__***MTU Hockey Transfer Alert***__\n%s\'s %s has transferred to %s.' % (origin_team, player_name, destination_team)
-                
-                webhook = DiscordWebhook(url=webhook_url, content=message)
-                webhook.execute()
-                published_transfers_file.write('%s,%s,%s\n' % (player_name, origin_team, destination_team))
-                published_transfers_file.flush()
+                    message = '%s\'s %s has transferred to %s.' % (origin_team, player_name, destination_team)
+        else:
+            # A new transfer has been identified, so publish a notification for it.
+            if destination_team == '?':
+                message = '%s\'s %s has entered the transfer portal.' % (origin_team, player_name)
+            elif origin_team == destination_team:
+                message = '%s\'s %s entered the transfer portal, but later withdrew to return to %s.' % (origin_team, player_name, destination_team)
+            else:
+                message = '%s\'s %s has transferred to %s.' % (origin_team, player_name, destination_team)
+
+        if message is not None:
+            # Once an alert is delivered, this is the version of the transfer recorded in published_transfers.txt (the complete one, if there's a destination team).
+            published_transfer = '%s,%s,%s' % (player_name, origin_team, destination_team)
+            published_transfer_line = '%s,%s\n' % (transfer_key[0], published_transfer)
+
+            # A transfer between two watched teams is sent to both of them.
+            involved_teams = []
+            for team_name in (origin_team, destination_team):
+                if team_name in team_name_index and team_name_index[team_name] not in involved_teams:
+                    involved_teams.append(team_name_index[team_name])
+
+            for team in involved_teams:
+                outbox.enqueue(get_team_alert_key(team, 'transfer:' + published_transfer), team['webhook_url'],
+                               '__***%s Transfer Alert***__\n%s' % (team['alert_prefix'], message), record=published_transfer_line)
+
+    # Record each transfer as published once Discord confirms receiving its alert.
+    def record_delivered_transfers(published_transfer_lines):
+        for published_transfer_line in published_transfer_lines:
+            transfer_key, published_transfer_parts = parse_published_transfer(published_transfer_line)
+            published_transfers[transfer_key] = (published_transfer_line, published_transfer_parts)
+
+    # Publish the queued alerts, along with any left over from previous invocations that couldn't be delivered.
+    with run_metrics.stage('dispatch'):
+        outbox.deliver(record_delivered_transfers)
+
+    # Only new or changed rows are processed, so this keeps the published transfers that didn't come up in this invocation too.
+    save_published_transfers(published_transfers)
 
 def main():
-    rink_live_portal_data = get_portal_spreadsheet_data(rink_live_spreadsheet_id, rink_live_tab_name)
-    gopher_puck_live_portal_data = get_portal_spreadsheet_data(gopher_puck_live_shreadsheet_id, gopher_puck_live_tab_name)
-    college_hockey_insider_portal_data = get_portal_spreadsheet_data(college_hockey_insider_spreadsheet_id, college_hockey_insider_tab_name)
-    process_portal_spreadsheet(rink_live_portal_data, 2, 1, 0, 11)
-    process_portal_spreadsheet(gopher_puck_live_portal_data, 1, 2, 1, 5)
-    process_portal_spreadsheet(college_hockey_insider_portal_data, 19, 7, 1, 10)
-    send_transfers_to_discord()
+    run_metrics.start_run()
+    try:
+        find_and_send_transfers()
+    finally:
+        run_metrics.finish_run('transfers', published_transfers_path)
+
+# Gather the transfers involving the watched teams from every transfer portal spreadsheet and publish the ones that are new or completed.
+def find_and_send_transfers():
+    # Transfers involving a watched team found in this invocation, keyed by get_transfer_key().
+    inter_university_transfers = {}
+    watched_teams = get_watched_teams()
+    team_alias_index = build_team_alias_index(watched_teams)
+    team_alias_fingerprint = get_team_alias_fingerprint(team_alias_index)
+
+    # Build the Sheets service before fetching in parallel, so the login flow (if it's needed) only happens once.
+    with run_metrics.stage('sheets client'):
+        get_sheets_service()
+
+    # Fetch only the origin team, player name and destination team columns of every spreadsheet at the same time.
+    with run_metrics.stage('sheet fetch'):
+        portal_spreadsheets_data = fetch_all(lambda portal_spreadsheet: get_portal_spreadsheet_data(portal_spreadsheet[0], portal_spreadsheet[1], portal_spreadsheet[3:]),
+                                             portal_spreadsheets)
+
+    # Process the spreadsheets in order, since a spreadsheet listed earlier takes precedence when merging transfers.
+    # Only the rows that are new or changed since the previous invocation are looked at.
+    portal_snapshots = load_portal_snapshots()
+    for portal_spreadsheet, portal_spreadsheet_data in zip(portal_spreadsheets, portal_spreadsheets_data):
+        if isinstance(portal_spreadsheet_data, FetchFailure) or len(portal_spreadsheet_data) == 0:
+            # The spreadsheet couldn't be loaded, so keep its previous snapshot until it can be.
+            continue
+
+        snapshot_key = get_snapshot_key(portal_spreadsheet[0], portal_spreadsheet[1])
+        previous_snapshot = portal_snapshots.get(snapshot_key)
+        if previous_snapshot is not None and previous_snapshot.get('team_aliases') != team_alias_fingerprint:
+            # The rows in the snapshot were only checked for the teams and aliases watched back then, so check every row again.
+            # Transfers that were already published aren't sent twice, since send_transfers_to_discord() skips them.
+            previous_snapshot = None
+
+        with run_metrics.stage('sheet merge'):
+            portal_snapshots[snapshot_key] = process_portal_spreadsheet(inter_university_transfers, team_alias_index, portal_spreadsheet_data, *portal_spreadsheet[2:],
+                                                                        previous_snapshot=previous_snapshot)
+            portal_snapshots[snapshot_key]['team_aliases'] = team_alias_fingerprint
+
+    run_metrics.increment('transfers_found', len(inter_university_transfers))
+
+    outbox = DiscordOutbox(published_transfers_path + 'discord_outbox.db', 'transfers')
+    try:
+        # Alerts queued before several teams could be watched were all about the legacy team.
+        outbox.adopt_alerts('transfer:')
+        outbox.add_key_prefix('transfer:', 'team:%s:' % legacy_team_id)
+        send_transfers_to_discord(outbox, watched_teams, inter_university_transfers)
+    finally:
+        outbox.close()
+
+    # Only save the snapshots once the transfers in them have been published.
+    save_portal_snapshots(portal_snapshots)
 
 if __name__ == '__main__': 
     main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import datetime
+import signal
+import time
+import traceback
+import discord_outbox
+import husky_transactions_watch
+import husky_transfers_watch
+import run_metrics
+from watched_teams import get_watched_teams
+
+# Seconds between polls of the EliteProspects transfers feed. Polls happen every feed_poll_interval seconds normally and every
+# busy_feed_poll_interval seconds during a busy window. Each poll that finds nothing new multiplies the wait by feed_backoff_factor,
+# up to feed_poll_interval during a busy window or max_feed_poll_interval otherwise.
+feed_poll_interval = 300
+busy_feed_poll_interval = 60
+max_feed_poll_interval = 1800
+feed_backoff_factor = 2
+
+# Seconds between checks of the transfer portal spreadsheets, normally and during a busy window.
+transfers_poll_interval = 900
+busy_transfers_poll_interval = 300
+
+# Periods of the year when transactions are frequent, as inclusive (month, day) start and end dates.
+# By default this covers the NCAA transfer portal window and the wave of commitments that follows it.
+busy_windows = [((3, 15), (5, 31))]
+
+# Set when the daemon has been asked to shut down. It's the outbox's stop event, so waiting out a Discord rate limit ends early too.
+stop_event = discord_outbox.stop_event
+
+# Check whether the given time falls inside one of the busy windows. A window can wrap around the end of the year.
+def in_busy_window(now):
+    today = (now.month, now.day)
+
+    for start, end in busy_windows:
+        if start <= end and start <= today <= end:
+            return True
+        if start > end and (today >= start or today <= end):
+            return True
+
+    return False
+
+# Decide how long to wait before polling the feed again based on whether the last poll found anything new.
+def next_feed_poll_interval(current_interval, feed_changed, busy):
+    shortest_interval = busy_feed_poll_interval if busy else feed_poll_interval
+    longest_interval = feed_poll_interval if busy else max_feed_poll_interval
+
+    if feed_changed:
+        return shortest_interval
+
+    return min(max(current_interval, shortest_interval) * feed_backoff_factor, longest_interval)
+
+# Poll the transfers feed and process it if it changed since the last poll, writing the poll's metrics afterwards.
+# Returns whether there were any new entries.
+def poll_feed(transaction_store, outbox, player_cache, feed_state):
+    run_metrics.start_run()
+    try:
+        return process_feed_changes(transaction_store, outbox, player_cache, feed_state)
+    finally:
+        run_metrics.finish_run('transactions', husky_transactions_watch.transaction_ids_path)
+
+def process_feed_changes(transaction_store, outbox, player_cache, feed_state):
+    feed = husky_transactions_watch.fetch_feed(feed_state['etag'], feed_state['modified'])
+
+    # Retry any alerts that couldn't be delivered during an earlier poll.
+    husky_transactions_watch.deliver_transactions(transaction_store, outbox)
+
+    if feed.get('status') == 304:
+        # The feed hasn't changed since the last poll.
+        return False
+
+    if len(feed.entries) == 0:
+        print('The transfers feed returned no entries: %s' % feed.get('bozo_exception', feed.get('status')))
+        return False
+
+    feed_guids = {item.guid for item in feed.entries}
+    if feed_guids <= feed_state['guids']:
+        # The feed was re-sent, but every entry in it was already processed. Its new validators are still kept, so the next poll can get a 304.
+        feed_state['etag'] = feed.get('etag')
+        feed_state['modified'] = feed.get('modified')
+        return False
+
+    published_transaction_ids = husky_transactions_watch.load_published_transaction_ids(transaction_store)
+    watched_teams = get_watched_teams()
+    roster_index = husky_transactions_watch.get_roster_index(watched_teams)
+    all_queued = husky_transactions_watch.process_feed(transaction_store, outbox, player_cache, watched_teams, roster_index, published_transaction_ids, feed)
+    player_cache.save()
+
+    if not all_queued:
+        # Some transactions couldn't be looked up, so process the feed again on the next poll instead of treating its entries as seen.
+        return True
+
+    # Only remember the feed's validators once it has been processed, so a failed poll is retried with a full download.
+    feed_state['etag'] = feed.get('etag')
+    feed_state['modified'] = feed.get('modified')
+    feed_state['guids'] = feed_guids
+    return True
+
+# Ask the main loop to stop once it finishes whatever it is doing.
+def handle_stop_signal(signal_number, frame):
+    print('Received signal %d, shutting down' % signal_number)
+    stop_event.set()
+
+# Keep watching the transfers feed and the transfer portal spreadsheets until a SIGTERM or SIGINT is received. Staying resident keeps
+# the imported modules, the HTTP session and the transaction database open between polls.
+def main():
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+
+    transaction_store = husky_transactions_watch.open_transaction_store()
+    outbox = husky_transactions_watch.open_outbox()
+    player_cache = husky_transactions_watch.open_player_cache()
+    feed_state = {'etag': None, 'modified': None, 'guids': set()}
+    current_feed_poll_interval = feed_poll_interval
+    next_feed_poll = next_transfers_poll = time.monotonic()
+
+    try:
+        while not stop_event.is_set():
+            busy = in_busy_window(datetime.datetime.now())
+
+            if time.monotonic() >= next_feed_poll:
+                try:
+                    feed_changed = poll_feed(transaction_store, outbox, player_cache, feed_state)
+                except Exception:
+                    traceback.print_exc()
+                    feed_changed = False
+
+                current_feed_poll_interval = next_feed_poll_interval(current_feed_poll_interval, feed_changed, busy)
+                next_feed_poll = time.monotonic() + current_feed_poll_interval
+
+            if time.monotonic() >= next_transfers_poll:
+                try:
+                    husky_transfers_watch.main()
+                except Exception:
+                    traceback.print_exc()
+
+                next_transfers_poll = time.monotonic() + (busy_transfers_poll_interval if busy else transfers_poll_interval)
+
+            # Sleep until the next poll is due, waking up early if a shutdown signal arrives.
+            stop_event.wait(max(0, min(next_feed_poll, next_transfers_poll) - time.monotonic()))
+    finally:
+        player_cache.save()
+        outbox.close()
+        transaction_store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+import run_metrics
+
+# A cache of per-player information (like their profile photo link) keyed by EliteProspects player ID and saved to disk between invocations.
+# Each field expires after its own TTL, and once more than max_players players are stored, the least recently used ones are dropped.
+# A field can be qualified with a suffix after a colon (like classification:548), sharing the TTL and hit counts of the field before it.
+class PlayerCache:
+    def __init__(self, path, field_ttls, max_players=2000):
+        self.path = path
+        self.field_ttls = field_ttls
+        self.max_players = max_players
+        self.players = OrderedDict()
+        self.hits = {field: 0 for field in field_ttls}
+        self.misses = {field: 0 for field in field_ttls}
+        self.lock = threading.Lock()
+        self.load()
+
+    # Read the players saved by a previous invocation. A missing or unreadable file just means starting with an empty cache.
+    def load(self):
+        try:
+            with open(self.path, 'r') as cache_file:
+                self.players = OrderedDict(json.load(cache_file))
+        except (OSError, ValueError):
+            self.players = OrderedDict()
+
+    # Write the cache to disk, least recently used players first so the order survives the next load().
+    def save(self):
+        with self.lock:
+            run_metrics.write_atomically(self.path, json.dumps(self.players))
+
+    # Look up a field for a player. Returns whether an unexpired value was found, and the value itself.
+    def lookup(self, player_id, field):
+        with self.lock:
+            player = self.players.get(player_id)
+
+            if player is not None and field in player:
+                value, stored_at = player[field]
+
+                if time.time() - stored_at < self.field_ttls[get_base_field(field)].total_seconds():
+                    self.players.move_to_end(player_id)
+                    self.hits[get_base_field(field)] += 1
+                    return True, value
+
+            self.misses[get_base_field(field)] += 1
+            return False, None
+
+    # Store a field for a player, evicting the least recently used players if the cache is full.
+    def store(self, player_id, field, value):
+        with self.lock:
+            self.players.setdefault(player_id, {})[field] = [value, time.time()]
+            self.players.move_to_end(player_id)
+
+            while len(self.players) > self.max_players:
+                self.players.popitem(last=False)
+
+    # Return a player's cached field, calling fetch_function() to get (and cache) it if it's missing or expired.
+    # Nothing is cached if fetch_function() raises.
+    def get(self, player_id, field, fetch_function):
+        found, value = self.lookup(player_id, field)
+
+        if not found:
+            value = fetch_function()
+            self.store(player_id, field, value)
+
+        return value
+
+    # Describe how many lookups of each field were answered from the cache.
+    def stats(self):
+        return ', '.join('%s: %d hits / %d misses' % (field, self.hits[field], self.misses[field]) for field in self.field_ttls)
+
+# Return the field a qualified field (like classification:548) belongs to.
+def get_base_field(field):
+    return field.split(':', 1)[0]
@@ -0,0 +1,321 @@
+# Replay both watchers end to end against local stand-ins for EliteProspects, Google Sheets and Discord, and report how long each stage takes.
+#
+# Usage:
+#   python replay/replay_harness.py
+#       Replay the recorded fixtures in replay/fixtures and check that the expected number of alerts were sent.
+#   python replay/replay_harness.py --feed-entries 10000 --sheet-rows 5000 --roster-size 2000
+#       Replay synthetic inputs of the given size instead.
+#   --max-seconds N
+#       Exit with an error if either watcher takes longer than N seconds, to catch performance regressions.
+import argparse
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+
+repo_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+fixtures_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+sys.path.insert(0, repo_directory)
+
+# The site the watchers think they are talking to. Requests to it are sent to the local server instead.
+eliteprospects_url = 'https://www.eliteprospects.com'
+
+# The number of alerts the recorded fixtures should produce: 4 from the transactions feed and 5 from the portal spreadsheets.
+fixture_expected_alerts = 9
+
+# The spreadsheets the transfers watcher is configured with, matching the files in fixtures/sheets.
+replay_spreadsheets = {
+    'rink_live': ('rink-live', 'Portal'),
+    'gopher_puck_live': ('gopher-puck-live', 'Tracker'),
+    'college_hockey_insider': ('college-hockey-insider', 'Portal 2025')
+}
+
+# Read a fixture file.
+def read_fixture(name):
+    with open(os.path.join(fixtures_directory, name), 'r', encoding='utf-8') as fixture_file:
+        return fixture_file.read()
+
+# A local HTTP server that serves the feed, the 'Where are they now' page, player pages and stats iframes, and captures the messages
+# posted to its webhook. Players with an odd ID are served a stats table that makes them a future player, the rest are former players.
+class ReplayServer:
+    def __init__(self, feed_text, roster_text):
+        self.feed_text = feed_text
+        self.roster_text = roster_text
+        self.player_template = read_fixture('player.html')
+        self.iframe_future = read_fixture('iframe_future.html')
+        self.iframe_former = read_fixture('iframe_former.html')
+        self.captured_messages = []
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(ReplayRequestHandler, self))
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Return the content type and body for a GET request, or None if the path isn't something we serve.
+    def get_page(self, path, query):
+        if path == '/rss/transfers':
+            return 'application/rss+xml', self.feed_text
+        if path.endswith('/where-are-they-now'):
+            return 'text/html', self.roster_text
+        if path.startswith('/player/'):
+            return 'text/html', self.player_template.replace('{player_id}', path.split('/')[2])
+        if path == '/iframe_player_stats.php':
+            player_id = int(query.get('player', ['0'])[0])
+            return 'text/html', self.iframe_future if player_id % 2 == 1 else self.iframe_former
+
+        return None
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    def __init__(self, replay_server, *args, **kwargs):
+        self.replay_server = replay_server
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        page = self.replay_server.get_page(url.path, urllib.parse.parse_qs(url.query))
+
+        with self.replay_server.lock:
+            self.replay_server.request_count += 1
+
+        if page is None:
+            self.send_error(404)
+            return
+
+        body = page[1].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', page[0])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        with self.replay_server.lock:
+            self.replay_server.request_count += 1
+            self.replay_server.captured_messages.append(payload)
+
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+# A transport adapter that sends requests for EliteProspects to the replay server instead.
+class ReplayAdapter(HTTPAdapter):
+    def __init__(self, replay_url):
+        super().__init__(pool_connections=16, pool_maxsize=16)
+        self.replay_url = replay_url
+
+    def send(self, request, **kwargs):
+        request.url = self.replay_url + request.url[len(eliteprospects_url):]
+        return super().send(request, **kwargs)
+
+# Wall time and number of calls of each stage, filled in by the wrappers from time_stage().
+stage_timings = {}
+stage_timings_lock = threading.Lock()
+
+# Replace a function in a module with a wrapper that adds the time spent in it to the given stage.
+def time_stage(module, function_name, stage_name):
+    function = getattr(module, function_name)
+
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with stage_timings_lock:
+                seconds, calls = stage_timings.get(stage_name, (0.0, 0))
+                stage_timings[stage_name] = (seconds + elapsed, calls + 1)
+
+    setattr(module, function_name, timed_function)
+
+# Write a links_and_paths.py pointing both watchers at the replay server and at empty state files in the given directory.
+def write_config(directory, webhook_url):
+    data_directory = os.path.join(directory, 'data') + os.sep
+    os.makedirs(data_directory)
+    open(data_directory + 'published_transfers.txt', 'w').close()
+
+    lines = [
+        'webhook_url = %r' % webhook_url,
+        'transaction_ids_path = %r' % data_directory,
+        'published_transfers_path = %r' % data_directory,
+        'token_json_path = %r' % data_directory,
+        'credentials_json_path = %r' % data_directory
+    ]
+    for name, (spreadsheet_id, tab_name) in replay_spreadsheets.items():
+        # The GopherPuckLive spreadsheet ID's name is spelled this way in links_and_paths.
+        id_name = 'gopher_puck_live_shreadsheet_id' if name == 'gopher_puck_live' else name + '_spreadsheet_id'
+        lines.append('%s = %r' % (id_name, spreadsheet_id))
+        lines.append('%s_tab_name = %r' % (name, tab_name))
+
+    with open(os.path.join(directory, 'links_and_paths.py'), 'w') as config_file:
+        config_file.write('\n'.join(lines) + '\n')
+
+# Build an RSS item in the format of the EliteProspects transfers feed.
+def make_feed_item(transaction_id, title, player_id, from_team_id, to_team_id):
+    description = ('Status: Confirmed<br />\nDate: 2025-04-01<br />\n'
+                   'Player: <a href="https://www.eliteprospects.com/player/%d/player-%d">Player %d</a><br />\n'
+                   'From: <a href="https://www.eliteprospects.com/team/%d/from-team">From Team</a><br />\n'
+                   'To: <a href="https://www.eliteprospects.com/team/%d/to-team">To Team</a><br />'
+                   % (player_id, player_id, player_id, from_team_id, to_team_id))
+    description = description.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    return '<item>\n<title>%s</title>\n<guid>https://www.eliteprospects.com/t/%d</guid>\n<description>%s</description>\n</item>\n' \
+           % (title, transaction_id, description)
+
+# Build a feed with the given number of entries. One in 50 is a player joining Michigan Tech, one in 50 involves a player on the roster,
+# and the rest don't involve Michigan Tech at all.
+def make_synthetic_feed(entry_count, roster_size):
+    items = []
+
+    for i in range(entry_count):
+        if i % 50 == 0:
+            items.append(make_feed_item(1000000 + i, 'Arrival %d' % i, 500000 + i, 1234, 548))
+        elif i % 50 == 1:
+            items.append(make_feed_item(1000000 + i, 'Roster player %d' % i, 100000 + (i % roster_size), 1234, 4321))
+        else:
+            items.append(make_feed_item(1000000 + i, 'Unrelated %d' % i, 700000 + i, 1234, 4321))
+
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0">\n<channel>\n<title>EliteProspects Transfers</title>\n%s</channel>\n</rss>\n' % ''.join(items)
+
+# Build a 'Where are they now' page listing the given number of players.
+def make_synthetic_roster(roster_size):
+    rows = ''.join('<tr><td class="player"><a href="https://www.eliteprospects.com/player/%d/player-%d">Player %d</a></td></tr>\n' % (100000 + i, 100000 + i, i)
+                   for i in range(roster_size))
+    return '<html>\n<body>\n<div class="expandable-table-wrapper">\n<table>\n%s</table>\n</div>\n</body>\n</html>\n' % rows
+
+# Write spreadsheets with the given number of rows each to the fake Sheets directory. One row in 100 involves Michigan Tech.
+def make_synthetic_sheets(directory, row_count):
+    # (starting row, origin team column, player name column, destination team column) of each spreadsheet, as in husky_transfers_watch.
+    layouts = {'rink_live': (2, 1, 0, 11), 'gopher_puck_live': (1, 2, 1, 5), 'college_hockey_insider': (19, 7, 1, 10)}
+
+    for name, (spreadsheet_id, tab_name) in replay_spreadsheets.items():
+        starting_row, origin_team_column, player_name_column, destination_team_column = layouts[name]
+        rows = [['header'] for _ in range(starting_row)]
+
+        for i in range(row_count):
+            row = [''] * (destination_team_column + 1)
+            row[player_name_column] = 'Player%d %s%d' % (i, name.title().replace('_', ''), i)
+            row[origin_team_column] = 'Michigan Tech' if i % 100 == 0 else 'Team %d' % (i % 60)
+            row[destination_team_column] = '' if i % 3 == 0 else 'Team %d' % ((i + 7) % 60)
+            rows.append(row)
+
+        with open(os.path.join(directory, spreadsheet_id + '.json'), 'w') as sheet_file:
+            json.dump({tab_name: rows}, sheet_file)
+
+# Run the transactions watcher against the replay server, timing each of its stages. Returns the total wall time.
+def run_transactions_watch(replay_server):
+    import husky_transactions_watch
+
+    time_stage(husky_transactions_watch, 'fetch_feed', 'transactions: feed fetch and parse')
+    time_stage(husky_transactions_watch, 'get_roster_index', 'transactions: roster fetch and index')
+    time_stage(husky_transactions_watch, 'resolve_match', 'transactions: classification and photos (summed over threads)')
+    time_stage(husky_transactions_watch, 'deliver_transactions', 'transactions: dispatch')
+
+    start = time.perf_counter()
+    husky_transactions_watch.main()
+    return time.perf_counter() - start
+
+# Run the transfers watcher against the fake Sheets backend and the replay server, timing each of its stages. Returns the total wall time.
+def run_transfers_watch():
+    import husky_transfers_watch
+
+    time_stage(husky_transfers_watch, 'fetch_all', 'transfers: sheet fetch (wall)')
+    time_stage(husky_transfers_watch, 'process_portal_spreadsheet', 'transfers: sheet merge')
+    time_stage(husky_transfers_watch, 'send_transfers_to_discord', 'transfers: dispatch')
+
+    start = time.perf_counter()
+    husky_transfers_watch.main()
+    return time.perf_counter() - start
+
+# Print the time spent in each stage. The feed matching and classification stages come from the transactions watcher's own metrics summary,
+# and the counters and HTTP statistics each watcher exported to its summary are printed after the stages.
+def print_report(transactions_seconds, transfers_seconds, replay_server, alert_count, data_directory):
+    summaries = {}
+    for run_name in ['transactions', 'transfers']:
+        with open(os.path.join(data_directory, '%s_metrics.json' % run_name), 'r') as metrics_file:
+            summaries[run_name] = json.load(metrics_file)
+
+    stage_timings['transactions: matching'] = (summaries['transactions']['stages'].get('matching', 0.0), 1)
+    stage_timings['transactions: classification and photos (wall)'] = (summaries['transactions']['stages'].get('classification and photos', 0.0), 1)
+
+    print('%-66s %10s %7s' % ('Stage', 'Seconds', 'Calls'))
+    for stage in sorted(stage_timings):
+        seconds, calls = stage_timings[stage]
+        print('%-66s %10.3f %7d' % (stage, seconds, calls))
+
+    print('%-66s %10.3f' % ('transactions: total', transactions_seconds))
+    print('%-66s %10.3f' % ('transfers: total', transfers_seconds))
+    print('Requests served: %d, webhook messages: %d, alerts: %d' % (replay_server.request_count, len(replay_server.captured_messages), alert_count))
+
+    for run_name, summary in summaries.items():
+        for name, count in sorted(summary['counters'].items()):
+            print('%-66s %10d' % ('%s: %s' % (run_name, name), count))
+        for host, stats in sorted(summary['http'].items()):
+            print('%-66s %10d requests, %d bytes, %.3f seconds' % ('%s: %s' % (run_name, host), stats['requests'], stats['bytes'], stats['seconds']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay both watchers against local fixtures and report per-stage timings.')
+    parser.add_argument('--feed-entries', type=int, help='replay a synthetic feed with this many entries instead of the fixtures')
+    parser.add_argument('--sheet-rows', type=int, default=5000, help='rows per synthetic spreadsheet (with --feed-entries)')
+    parser.add_argument('--roster-size', type=int, default=1000, help='players on the synthetic roster (with --feed-entries)')
+    parser.add_argument('--max-seconds', type=float, help='fail if either watcher takes longer than this')
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix='huskywatch-replay-')
+    sheets_directory = os.path.join(work_directory, 'sheets')
+
+    try:
+        if args.feed_entries is None:
+            feed_text = read_fixture('transfers.xml')
+            roster_text = read_fixture('where_are_they_now.html')
+            shutil.copytree(os.path.join(fixtures_directory, 'sheets'), sheets_directory)
+        else:
+            feed_text = make_synthetic_feed(args.feed_entries, args.roster_size)
+            roster_text = make_synthetic_roster(args.roster_size)
+            os.makedirs(sheets_directory)
+            make_synthetic_sheets(sheets_directory, args.sheet_rows)
+
+        replay_server = ReplayServer(feed_text, roster_text)
+        write_config(work_directory, replay_server.url + '/webhook')
+        sys.path.insert(0, work_directory)
+        os.environ['HUSKYWATCH_FAKE_SHEETS_DIR'] = sheets_directory
+
+        import http_fetch
+        http_fetch.session.mount(eliteprospects_url, ReplayAdapter(replay_server.url))
+
+        transactions_seconds = run_transactions_watch(replay_server)
+        transfers_seconds = run_transfers_watch()
+        replay_server.shutdown()
+
+        alert_count = sum(message['content'].count('__***') for message in replay_server.captured_messages)
+        print_report(transactions_seconds, transfers_seconds, replay_server, alert_count, os.path.join(work_directory, 'data'))
+
+        if args.feed_entries is None and alert_count != fixture_expected_alerts:
+            print('FAILED: expected %d alerts from the fixtures, got %d' % (fixture_expected_alerts, alert_count))
+            sys.exit(1)
+
+        if args.max_seconds is not None and max(transactions_seconds, transfers_seconds) > args.max_seconds:
+            print('FAILED: a watcher took longer than %.1f seconds' % args.max_seconds)
+            sys.exit(1)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+# Metrics collected during a run: wall time per stage, event counters, and request count, response bytes and latency per HTTP host.
+# Stages that run on several threads at once add up the time spent on each thread.
+stage_seconds = {}
+counters = {}
+host_stats = {}
+metrics_lock = threading.Lock()
+run_started_at = None
+profiler = None
+
+# Clear the metrics of the previous run and start timing a new one. If the HUSKYWATCH_PROFILE environment variable is set to a file path,
+# the sampling profiler is started too, and its samples are appended to that file when the run finishes (flame graph tools add up
+# repeated stacks, so the samples of several runs can share a file).
+def start_run():
+    global run_started_at, profiler
+
+    with metrics_lock:
+        stage_seconds.clear()
+        counters.clear()
+        host_stats.clear()
+
+    run_started_at = time.time()
+
+    if os.environ.get('HUSKYWATCH_PROFILE'):
+        profiler = SamplingProfiler(float(os.environ.get('HUSKYWATCH_PROFILE_INTERVAL', '0.005')))
+        profiler.start()
+
+# Time the code run inside the with block as part of the named stage.
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+def add_stage_time(name, seconds):
+    with metrics_lock:
+        stage_seconds[name] = stage_seconds.get(name, 0.0) + seconds
+
+def increment(name, amount=1):
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + amount
+
+# Record a request made to a host, how many bytes its response had and how long it took.
+def record_request(host, byte_count, seconds):
+    with metrics_lock:
+        stats = host_stats.setdefault(host, {'requests': 0, 'bytes': 0, 'seconds': 0.0})
+        stats['requests'] += 1
+        stats['bytes'] += byte_count
+        stats['seconds'] += seconds
+
+# A requests response hook recording every request made through a session.
+def record_response(response, *args, **kwargs):
+    record_request(urllib.parse.urlsplit(response.url).netloc, len(response.content), response.elapsed.total_seconds())
+
+# Stop timing the run and write its metrics. A JSON summary named <run name>_metrics.json is written to the HUSKYWATCH_METRICS_DIR
+# environment variable's directory (or default_directory), and a Prometheus textfile collector file named huskywatch_<run name>.prom is
+# written to HUSKYWATCH_TEXTFILE_DIR (or the same directory as the summary).
+def finish_run(run_name, default_directory):
+    global profiler
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.write(os.environ['HUSKYWATCH_PROFILE'])
+        profiler = None
+
+    finished_at = time.time()
+    with metrics_lock:
+        summary = {
+            'run': run_name,
+            'started_at': run_started_at,
+            'finished_at': finished_at,
+            'duration_seconds': finished_at - run_started_at,
+            'stages': dict(stage_seconds),
+            'counters': dict(counters),
+            'http': {host: dict(stats) for host, stats in host_stats.items()}
+        }
+
+    metrics_directory = os.environ.get('HUSKYWATCH_METRICS_DIR', default_directory)
+    textfile_directory = os.environ.get('HUSKYWATCH_TEXTFILE_DIR', metrics_directory)
+
+    write_atomically(os.path.join(metrics_directory, '%s_metrics.json' % run_name), json.dumps(summary, indent=2) + '\n')
+    write_atomically(os.path.join(textfile_directory, 'huskywatch_%s.prom' % run_name), format_prometheus(summary))
+    return summary
+
+# Format a run summary in the Prometheus text exposition format.
+def format_prometheus(summary):
+    run_label = 'run="%s"' % escape_label(summary['run'])
+    lines = [
+        '# HELP huskywatch_last_run_timestamp_seconds When the run finished.',
+        '# TYPE huskywatch_last_run_timestamp_seconds gauge',
+        'huskywatch_last_run_timestamp_seconds{%s} %f' % (run_label, summary['finished_at']),
+        '# HELP huskywatch_run_duration_seconds Wall time of the whole run.',
+        '# TYPE huskywatch_run_duration_seconds gauge',
+        'huskywatch_run_duration_seconds{%s} %f' % (run_label, summary['duration_seconds']),
+        '# HELP huskywatch_stage_seconds Time spent in each stage of the run.',
+        '# TYPE huskywatch_stage_seconds gauge'
+    ]
+    lines += ['huskywatch_stage_seconds{%s,stage="%s"} %f' % (run_label, escape_label(name), seconds) for name, seconds in sorted(summary['stages'].items())]
+
+    lines += ['# HELP huskywatch_events Number of times each event happened during the run.', '# TYPE huskywatch_events gauge']
+    lines += ['huskywatch_events{%s,event="%s"} %d' % (run_label, escape_label(name), count) for name, count in sorted(summary['counters'].items())]
+
+    for field, description in [('requests', 'HTTP requests made'), ('bytes', 'HTTP response bytes received'), ('seconds', 'Time spent waiting on HTTP requests')]:
+        metric = 'huskywatch_http_%s' % field
+        lines += ['# HELP %s %s to each host during the run.' % (metric, description), '# TYPE %s gauge' % metric]
+        lines += ['%s{%s,host="%s"} %s' % (metric, run_label, escape_label(host), stats[field]) for host, stats in sorted(summary['http'].items())]
+
+    return '\n'.join(lines) + '\n'
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Write a file by writing a temporary file and renaming it over the original, so readers (like node_exporter, or the next invocation)
+# never see a partial file. The watchers save their state files with this too.
+def write_atomically(path, text):
+    with open(path + '.tmp', 'w') as output_file:
+        output_file.write(text)
+        output_file.flush()
+
+    os.replace(path + '.tmp', path)
+
+# A profiler that samples the stack of every thread at a fixed interval from a background thread. The samples are written in the
+# folded stack format ('frame;frame;frame count' per line) that flame graph tools read.
+class SamplingProfiler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.thread.ident:
+                    continue
+
+                # Frames are named by function rather than line, so samples from anywhere in a function are counted together.
+                frame_names = []
+                while frame is not None:
+                    frame_names.append('%s (%s:%d)' % (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename), frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+
+                stack = ';'.join(reversed(frame_names))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def write(self, path):
+        with open(path, 'a') as profile_file:
+            for stack, count in sorted(self.samples.items(), key=lambda sample: -sample[1]):
+                profile_file.write('%s %d\n' % (stack, count))
@@ -0,0 +1,47 @@
+import hashlib
+import links_and_paths
+
+# The teams whose transactions and transfers are published. Each team has its EliteProspects team ID, the name EliteProspects and the alerts
+# use for it, the prefix of its alerts' titles, the other names the transfer portal spreadsheets may use for it, its 'Where are they now' page
+# (listing its future and former players) and the Discord webhook its alerts are sent to.
+# A different list can be given as watched_teams in links_and_paths. Without one, only Michigan Tech is watched, as before.
+default_watched_teams = [
+    {
+        'team_id': '548',
+        'name': 'Michigan Tech',
+        'alert_prefix': 'MTU Hockey',
+        'aliases': ['Michigan Technological University', 'Michigan Tech'],
+        'roster_url': 'https://www.eliteprospects.com/team/548/michigan-tech/where-are-they-now?sort=tp',
+        'webhook_url': links_and_paths.webhook_url
+    }
+]
+
+# The team that everything published before several teams could be watched belongs to.
+legacy_team_id = '548'
+
+def get_watched_teams():
+    return getattr(links_and_paths, 'watched_teams', None) or default_watched_teams
+
+# Index the watched teams by their EliteProspects team ID, so the teams in a transaction can be looked up directly.
+def build_team_id_index(watched_teams):
+    return {team['team_id']: team for team in watched_teams}
+
+# Index the watched teams by every name they may be called in a transfer portal spreadsheet (their aliases, and their own name).
+def build_team_alias_index(watched_teams):
+    team_alias_index = {}
+
+    for team in watched_teams:
+        for alias in team['aliases'] + [team['name']]:
+            team_alias_index.setdefault(alias, team)
+
+    return team_alias_index
+
+# Summarize which names map to which watched teams, so data processed with a different set of watched teams (or aliases) can be recognized.
+def get_team_alias_fingerprint(team_alias_index):
+    aliases = '\x1f'.join('%s\x1e%s' % (alias, team['team_id']) for alias, team in sorted(team_alias_index.items()))
+    return hashlib.sha1(aliases.encode('utf-8')).hexdigest()[:16]
+
+# The key an alert about a team is queued under in the outbox. The same transaction or transfer can concern more than one watched team,
+# and each of them gets its own alert.
+def get_team_alert_key(team, alert_key):
+    return 'team:%s:%s' % (team['team_id'], alert_key)